@@ -1,8 +1,4 @@
 import streamlit as st
-import pandas as pd
-import numpy as np
-import fitz  # PyMuPDF
-import openai
 import time
 
 st.set_page_config(page_title="PDF Quiz Generator", layout="wide")
@@ -50,6 +46,7 @@ st.markdown("""
 
 # Function to extract text from PDF
 def extract_text_from_pdf(file):
+    import fitz  # PyMuPDF, loaded only once a PDF is uploaded
     text = ""
     pdf_document = fitz.open(stream=file.read(), filetype="pdf")
     for page in pdf_document:
@@ -58,6 +55,7 @@ def extract_text_from_pdf(file):
 
 # Function to generate questions using OpenAI API
 def generate_questions(text, num_questions, difficulty, model, api_key):
+    import openai  # Loaded only when questions are generated
     openai.api_key = api_key
 
     messages = [
@@ -1,8 +1,4 @@
 import streamlit as st
-import pandas as pd
-import numpy as np
-import fitz  # PyMuPDF
-import openai
 import time
 import re
 import os
@@ -52,6 +48,7 @@ st.markdown("""
 
 # Function to extract text from PDF
 def extract_text_from_pdf(file):
+    import fitz  # PyMuPDF, loaded only once a PDF is uploaded
     text = ""
     try:
         pdf_document = fitz.open(stream=file.read(), filetype="pdf")
@@ -67,6 +64,7 @@ def chunk_text(text, chunk_size=1000):
 
 # Function to generate questions using OpenAI API
 def generate_questions(text, num_questions, difficulty, model, api_key):
+    import openai  # Loaded only when questions are generated
     openai.api_key = api_key
 
     messages = [
@@ -0,0 +1,107 @@
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pyarrow as pa
+
+from examtool_pipeline import (
+    attempt_history_schema,
+    attempt_history_trends,
+    compact_attempt_partition,
+    load_attempt_history,
+    record_attempt,
+    write_attempt_file,
+)
+
+DASHBOARD_COLUMNS = ["date", "difficulty", "percentage", "total_seconds"]
+
+
+# Function to build one synthetic attempt row
+def make_attempt(rng, submitted_at):
+    questions = rng.choice([5, 10, 20])
+    correct = rng.randint(0, questions)
+    return {
+        "attempt_id": uuid.uuid4().hex,
+        "submitted_at": submitted_at,
+        "doc_hash": f"doc{rng.randrange(50)}",
+        "difficulty": rng.choice(["Easy", "Medium", "Hard"]),
+        "model": "gpt-3.5-turbo",
+        "questions": questions,
+        "correct": correct,
+        "percentage": correct * 100.0 / questions,
+        "total_seconds": rng.uniform(30, 900),
+        "dwell_p50": rng.uniform(2, 40),
+        "dwell_p90": rng.uniform(10, 120),
+    }
+
+
+# Function to fill a history directory with the given number of attempts spread over the days, as compacted partitions
+def populate(path, attempts, days, seed=0):
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    per_day = max(1, attempts // days)
+    for day in range(days):
+        submitted_at = now - timedelta(days=day)
+        partition = os.path.join(path, f"date={submitted_at:%Y-%m-%d}")
+        os.makedirs(partition, exist_ok=True)
+        rows = [make_attempt(rng, submitted_at) for _ in range(per_day)]
+        write_attempt_file(pa.Table.from_pylist(rows, schema=attempt_history_schema()), partition)
+
+
+# Function to time one dashboard query and keep the best of several runs
+def time_query(path, days, difficulty, repeats):
+    best = float("inf")
+    rows = 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        since = datetime.now(timezone.utc) - timedelta(days=days - 1)
+        table = load_attempt_history(DASHBOARD_COLUMNS, since=since, difficulty=difficulty, path=path)
+        attempt_history_trends(table)
+        best = min(best, time.perf_counter() - start)
+        rows = table.num_rows
+    return best, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time attempt history writes and dashboard queries")
+    parser.add_argument("--attempts", type=int, nargs="+", default=[10000, 50000, 200000])
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--appends", type=int, default=200, help="Single attempts appended through record_attempt")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'attempts':>9} {'query':>22} {'rows':>8} {'seconds':>9}")
+    for attempts in args.attempts:
+        path = tempfile.mkdtemp(prefix="attempt_history_")
+        try:
+            populate(path, attempts, args.days)
+            for days, difficulty in ((args.days, None), (30, None), (30, "Hard"), (7, "Easy")):
+                seconds, rows = time_query(path, days, difficulty, args.repeats)
+                label = f"{days} days / {difficulty or 'all'}"
+                print(f"{attempts:>9} {label:>22} {rows:>8} {seconds:>9.4f}")
+        finally:
+            shutil.rmtree(path)
+
+    path = tempfile.mkdtemp(prefix="attempt_history_")
+    try:
+        rng = random.Random(1)
+        start = time.perf_counter()
+        for _ in range(args.appends):
+            record_attempt(make_attempt(rng, None), path=path)
+        elapsed = time.perf_counter() - start
+        partition = os.path.join(path, os.listdir(path)[0])
+        compact_attempt_partition(partition)
+        table = load_attempt_history(["attempt_id"], path=path)
+        assert table.num_rows == args.appends, "compaction must keep every attempt"
+        print(f"Appended {args.appends} attempts in {elapsed:.3f}s ({elapsed / args.appends * 1000:.2f} ms each)")
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import argparse
+import json
+import random
+import re
+import time
+
+from examtool_pipeline import QuestionParser, json_decoder, question_from_json
+
+
+# The parser the app shipped before the single-pass state machine, kept here for comparison
+def legacy_parse_questions(raw_questions):
+    questions = []
+    for question in raw_questions.split("\n\n"):
+        if question.strip():
+            try:
+                parts = question.split("\n")
+                q = parts[0].strip()
+                options = []
+                correct_answer = None
+
+                for option in parts[1:]:
+                    match = re.match(r"^[A-D]\)", option.strip())
+                    if match:
+                        options.append(option.strip())
+
+                correct_match = re.search(r"Correct Answer:\s*([A-D])", " ".join(parts))
+                if correct_match:
+                    correct_letter = correct_match.group(1)
+                    correct_answer = next((opt for opt in options if opt.startswith(f"{correct_letter})")), None)
+
+                if len(options) == 4 and correct_answer:
+                    questions.append({
+                        "question": q,
+                        "options": options,
+                        "correct": correct_answer
+                    })
+            except Exception:
+                pass
+
+    return questions
+
+
+# Function to build raw model output with the given number of questions
+def make_raw_output(num_questions, malformed_rate=0.05, missing_blank_rate=0.1, seed=0):
+    rng = random.Random(seed)
+    blocks = []
+    for i in range(num_questions):
+        lines = [f"{i + 1}. Which statement about topic {rng.randint(1, 500)} is correct?"]
+        options = 3 if rng.random() < malformed_rate else 4
+        lines.extend(f"{letter}) Option {letter} for question {i + 1}" for letter in "ABCD"[:options])
+        lines.append(f"Correct Answer: {rng.choice('ABCD'[:options])}")
+        blocks.append("\n".join(lines))
+    parts = [blocks[0]] if blocks else []
+    for block in blocks[1:]:
+        parts.append("\n" if rng.random() < missing_blank_rate else "\n\n")
+        parts.append(block)
+    return "".join(parts)
+
+
+# Function to build the same kind of output as function-call arguments, with the same share of broken questions
+def make_json_output(num_questions, malformed_rate=0.05, seed=0):
+    rng = random.Random(seed)
+    items = []
+    for i in range(num_questions):
+        item = {
+            "question": f"Which statement about topic {rng.randint(1, 500)} is correct?",
+            "options": [f"Option {letter} for question {i + 1}" for letter in "ABCD"],
+            "correct": rng.choice("ABCD"),
+        }
+        if rng.random() < malformed_rate:
+            del item["options"][-1]
+        items.append(item)
+    return json.dumps({"questions": items})
+
+
+# Function to decode structured output with the given decoder and keep the questions that fit the schema
+def parse_json_with(decode):
+    def parse(raw):
+        questions = (question_from_json(item) for item in decode(raw)["questions"])
+        return [question for question in questions if question is not None]
+    return parse
+
+
+# Function to time a parser over several repeats and keep the best run
+def best_time(fn, raw, repeats):
+    best = float("inf")
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn(raw)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+# Function to parse the whole output in one feed
+def parse_all(raw):
+    parser = QuestionParser()
+    questions = parser.feed(raw)
+    questions.extend(parser.close())
+    return questions
+
+
+# Function to parse the output in small pieces, the way a streamed response arrives
+def parse_incrementally(raw, piece_size=64):
+    parser = QuestionParser()
+    questions = []
+    for i in range(0, len(raw), piece_size):
+        questions.extend(parser.feed(raw[i:i + piece_size]))
+    questions.extend(parser.close())
+    return questions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Compare the question parser with the legacy implementation")
+    arg_parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 50000])
+    arg_parser.add_argument("--repeats", type=int, default=5)
+    args = arg_parser.parse_args()
+
+    print(
+        f"{'questions':>10} {'legacy s':>10} {'parser s':>10} {'stream s':>10} {'speedup':>8} {'legacy kept':>12} {'parser kept':>12} "
+        f"{'json s':>10} {'fast json s':>12} {'json kept':>10}"
+    )
+    for size in args.sizes:
+        raw = make_raw_output(size)
+        legacy_time, legacy_result = best_time(legacy_parse_questions, raw, args.repeats)
+        parser_time, parser_result = best_time(parse_all, raw, args.repeats)
+        stream_time, stream_result = best_time(parse_incrementally, raw, args.repeats)
+        assert stream_result == parser_result, "incremental parsing must match whole-text parsing"
+        raw_json = make_json_output(size)
+        json_time, _ = best_time(parse_json_with(json.loads), raw_json, args.repeats)
+        fast_json_time, json_result = best_time(parse_json_with(json_decoder()), raw_json, args.repeats)
+        print(
+            f"{size:>10} {legacy_time:>10.4f} {parser_time:>10.4f} {stream_time:>10.4f} "
+            f"{legacy_time / parser_time:>7.1f}x {len(legacy_result):>12} {len(parser_result):>12} "
+            f"{json_time:>10.4f} {fast_json_time:>12.4f} {len(json_result):>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import argparse
+import atexit
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# The offline backend should never wait on the production rate limits
+os.environ.setdefault("EXAMTOOL_REQUESTS_PER_MINUTE", "1000000000")
+os.environ.setdefault("EXAMTOOL_TOKENS_PER_MINUTE", "1000000000")
+os.environ.setdefault("EXAMTOOL_BACKEND", "fake")
+# A fresh cache directory keeps extraction cold and the question bank empty on every run
+os.environ["EXAMTOOL_CACHE_DIR"] = tempfile.mkdtemp(prefix="examtool_bench_")
+atexit.register(shutil.rmtree, os.environ["EXAMTOOL_CACHE_DIR"], True)
+
+import fitz  # PyMuPDF
+# The app imports NumPy on first use; load it here so the first dedup stage doesn't pay for the import
+import numpy  # noqa: F401
+# The scheduler imports openai for its retryable errors on the first request; load it here for the same reason
+import openai  # noqa: F401
+
+# The fake backend breaks some questions on purpose; keep the parser's skip warnings out of the table
+logging.getLogger("examtool_pipeline").setLevel(logging.ERROR)
+# AppTest seeds session state outside a script run, which Streamlit reports as a bare-mode warning; Streamlit
+# resets its loggers' levels when it loads its config, so the logger is disabled rather than raised to ERROR
+logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").disabled = True
+
+from examtool_pipeline import (
+    DEFAULT_CHUNK_OVERLAP_TOKENS,
+    DEFAULT_CHUNK_TOKENS,
+    FakeBackend,
+    Instrumentation,
+    build_quiz,
+)
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+# Stages reported from the spans build_quiz records, in pipeline order
+STAGE_SPANS = {
+    "extract": "extract",
+    "chunk_text": "chunk",
+    "select_chunks": "select",
+    "allocate": "allocate",
+    "generate": "generate",
+    "parse": "parse",
+    "dedup": "dedup",
+    "top_up": "top_up",
+}
+WORDS = (
+    "cell membrane protein energy enzyme nucleus gene mitochondria photosynthesis carbon oxygen water "
+    "reaction molecule structure function system process theory evidence model variable experiment result "
+    "market price demand supply cost revenue policy growth inflation capital labour trade contract law"
+).split()
+
+
+# Function to build a synthetic PDF with paragraphs of pseudo-random sentences on every page
+def make_synthetic_pdf(num_pages, seed=0):
+    rng = random.Random(seed)
+    document = fitz.open()
+    for page_number in range(num_pages):
+        page = document.new_page()
+        paragraphs = []
+        for _ in range(4):
+            sentences = [
+                " ".join(rng.choices(WORDS, k=rng.randint(8, 16))).capitalize() + "."
+                for _ in range(rng.randint(3, 6))
+            ]
+            paragraphs.append(" ".join(sentences))
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), f"Chapter {page_number + 1}\n\n" + "\n\n".join(paragraphs), fontsize=10)
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+# Function to run a stage under a timer and tracemalloc, returning its result, seconds and peak MiB
+def measure(fn, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / (1024 * 1024)
+
+
+# Function to time a rerun of the Streamlit app showing an existing quiz, as on every answer or page change.
+# The first run loads the script and its imports, which a live server only pays once.
+def render_quiz(questions):
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        return None
+    app = AppTest.from_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), "examtool_V05.py"), default_timeout=600)
+    app.session_state["questions"] = questions
+    app.session_state["start_time"] = time.time()
+    app.session_state["results_displayed"] = False
+    app.run()
+    _, seconds, peak = measure(app.run)
+    if app.exception or not app.radio:
+        raise RuntimeError(f"The quiz did not render: {[e.value for e in app.exception]}")
+    return {"seconds": seconds, "peak_mib": peak}
+
+
+# Function to build a quiz from a synthetic PDF through build_quiz, the code path of the app and the CLI,
+# and read each stage's time and peak memory from the spans it records while tracemalloc is tracing
+def run_pipeline(num_pages, num_questions, workers, backend):
+    pdf_bytes = make_synthetic_pdf(num_pages)
+    metrics = Instrumentation()
+    # The app's default settings, except that cached responses and the question bank are bypassed
+    questions, seconds, _ = measure(
+        build_quiz, pdf_bytes, num_questions, "Medium", "gpt-3.5-turbo", backend, workers,
+        DEFAULT_CHUNK_TOKENS, DEFAULT_CHUNK_OVERLAP_TOKENS, False, False, metrics, None, False
+    )
+    stages = {}
+    for span, stage in STAGE_SPANS.items():
+        records = [record for record in metrics.records if record["span"] == span]
+        if records:
+            stages[stage] = {"seconds": sum(record["seconds"] for record in records)}
+            # Parse spans run inside generate and top-up, so their memory is part of those stages' peaks
+            peaks = [record["peak_mib"] for record in records if "peak_mib" in record]
+            if peaks:
+                stages[stage]["peak_mib"] = max(peaks)
+    # Spans reset the tracemalloc peak, so the whole build's peak is its largest stage's
+    stages["build_quiz"] = {
+        "seconds": seconds, "peak_mib": max(stage["peak_mib"] for stage in stages.values() if "peak_mib" in stage)
+    }
+
+    render = render_quiz(questions)
+    if render is not None:
+        stages["render"] = render
+
+    spans = {record["span"]: record for record in metrics.records}
+    summary = {
+        "chunks": spans["chunk_text"]["chunks"],
+        "requests": sum(1 for record in metrics.records if record["span"] == "chunk"),
+        "questions": len(questions),
+    }
+    return stages, summary
+
+
+# Function to list stages that got slower or used more memory than the baseline by more than the tolerance
+def find_regressions(results, baseline, tolerance, slack, memory_slack):
+    regressions = []
+    for pages, stages in results.items():
+        for stage, metrics in stages.items():
+            expected = baseline.get(pages, {}).get(stage)
+            if expected is None:
+                continue
+            limit = expected["seconds"] * (1 + tolerance) + slack
+            if metrics["seconds"] > limit:
+                regressions.append(f"{pages} pages / {stage}: {metrics['seconds']:.3f}s > {limit:.3f}s allowed")
+            if "peak_mib" in metrics and "peak_mib" in expected:
+                limit = expected["peak_mib"] * (1 + tolerance) + memory_slack
+                if metrics["peak_mib"] > limit:
+                    regressions.append(f"{pages} pages / {stage}: {metrics['peak_mib']:.2f} MiB > {limit:.2f} MiB allowed")
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark the PDF quiz pipeline on synthetic documents with an offline model")
+    arg_parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 100, 1000])
+    # The app's default count; a handful of questions per document is what makes chunk selection cluster
+    arg_parser.add_argument("--questions", type=int, default=5, help="Questions requested per document")
+    arg_parser.add_argument("--workers", type=int, default=8)
+    arg_parser.add_argument("--tolerance", type=float, default=0.5,
+                            help="Allowed slowdown or memory growth over the baseline, as a fraction")
+    arg_parser.add_argument("--slack", type=float, default=0.05, help="Absolute seconds added to every limit to absorb timer noise")
+    arg_parser.add_argument("--memory-slack", type=float, default=0.5,
+                            help="Absolute MiB added to every memory limit to absorb allocator noise")
+    arg_parser.add_argument("--update-baseline", action="store_true", help="Store these results as the new baseline")
+    args = arg_parser.parse_args()
+
+    # Zero latency and very high throughput leave only the pipeline's own overhead
+    backend = FakeBackend(latency=0.0, tokens_per_second=1e9, malformed_rate=0.05)
+    results = {}
+    print(f"{'pages':>6} {'stage':>10} {'seconds':>9} {'peak MiB':>9}")
+    for num_pages in args.pages:
+        stages, summary = run_pipeline(num_pages, args.questions, args.workers, backend)
+        results[str(num_pages)] = stages
+        for stage, metrics in stages.items():
+            peak = f"{metrics['peak_mib']:>9.2f}" if "peak_mib" in metrics else f"{'-':>9}"
+            print(f"{num_pages:>6} {stage:>10} {metrics['seconds']:>9.4f} {peak}")
+        print(f"{num_pages:>6} {'':>10} {summary['chunks']} chunks, {summary['requests']} requests, {summary['questions']} questions")
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH, encoding="utf-8") as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {BASELINE_PATH}")
+        return
+
+    if not os.path.exists(BASELINE_PATH):
+        print("No baseline stored yet; run with --update-baseline to create one.")
+        return
+    with open(BASELINE_PATH, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = find_regressions(results, baseline, args.tolerance, args.slack, args.memory_slack)
+    if regressions:
+        print("Regressions against the stored baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print("No regressions against the stored baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import argparse
+import random
+import time
+
+import numpy as np
+
+from examtool_pipeline import ScoringEngine
+
+
+# Function to build a quiz spread over several page ranges and difficulties
+def make_questions(num_questions, seed=0):
+    rng = random.Random(seed)
+    questions = []
+    for i in range(num_questions):
+        options = [f"{letter}) Option {letter} for question {i + 1}" for letter in "ABCD"]
+        page_start = 1 + (i // 5) * 3
+        questions.append({
+            "question": f"{i + 1}. Question {i + 1}",
+            "options": options,
+            "correct": rng.choice(options),
+            "difficulty": rng.choice(["Easy", "Medium", "Hard"]),
+            "page_start": page_start,
+            "page_end": page_start + 2,
+        })
+    return questions
+
+
+# Function to score attempts the way the Submit handler used to, comparing option strings
+def legacy_scores(questions, attempts):
+    return [
+        sum(1 for question, selected in zip(questions, attempt) if selected == question["correct"])
+        for attempt in attempts
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare vectorised scoring with per-string comparisons")
+    parser.add_argument("--questions", type=int, default=50)
+    parser.add_argument("--attempts", type=int, nargs="+", default=[1, 100, 1000, 10000])
+    args = parser.parse_args()
+
+    questions = make_questions(args.questions)
+    engine = ScoringEngine(questions)
+    rng = random.Random(1)
+    print(f"{'attempts':>9} {'legacy s':>10} {'engine s':>10} {'report s':>10} {'speedup':>8}")
+    for num_attempts in args.attempts:
+        rows = [[rng.randrange(4) for _ in questions] for _ in range(num_attempts)]
+        attempts = [[q["options"][j] for q, j in zip(questions, row)] for row in rows]
+        # Responses are stored as option indices, so the engine receives them already as an array
+        indices = np.array(rows, dtype=np.int8)
+
+        start = time.perf_counter()
+        expected = legacy_scores(questions, attempts)
+        legacy_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        scores = engine.scores(indices)
+        engine_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        engine.report(indices)
+        report_seconds = time.perf_counter() - start
+
+        assert scores.tolist() == expected, "vectorised scores must match the string comparison"
+        print(
+            f"{num_attempts:>9} {legacy_seconds:>10.4f} {engine_seconds:>10.4f} {report_seconds:>10.4f} "
+            f"{legacy_seconds / engine_seconds:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import argparse
+import random
+import time
+
+from examtool_pipeline import allocate_questions, iter_chunks, select_salient_chunks
+
+FUNCTION_WORDS = "the of and to in is that for with as by on are this which from".split()
+
+
+# Function to write one page of prose about a topic, using that topic's own vocabulary
+def prose_page(rng, vocabulary, sentences=24):
+    lines = []
+    for _ in range(sentences):
+        words = []
+        for _ in range(rng.randint(10, 18)):
+            words.append(rng.choice(vocabulary) if rng.random() < 0.6 else rng.choice(FUNCTION_WORDS))
+        lines.append(" ".join(words).capitalize() + ".")
+    return " ".join(lines)
+
+
+# Function to write a page of back matter: an index or a bibliography
+def filler_page(rng, vocabulary, kind):
+    if kind == "index":
+        entries = [f"{rng.choice(vocabulary)}, {rng.randint(1, 500)}, {rng.randint(1, 500)}-{rng.randint(1, 500)}" for _ in range(60)]
+    else:
+        entries = [
+            f"{rng.choice(vocabulary).capitalize()}, {rng.choice('ABCDEFGH')}. ({rng.randint(1950, 2024)}). "
+            f"{rng.choice(vocabulary).capitalize()} {rng.choice(vocabulary)}. J. {rng.choice(vocabulary).capitalize()}, "
+            f"{rng.randint(1, 80)}({rng.randint(1, 12)}), {rng.randint(1, 900)}-{rng.randint(1, 900)}."
+            for _ in range(25)
+        ]
+    return "\n".join(entries)
+
+
+# Function to build a book of topics in consecutive sections followed by index and bibliography pages
+def make_book(num_pages, num_topics, back_matter_share=0.1, seed=0):
+    rng = random.Random(seed)
+    syllables = ["ka", "lo", "mi", "nu", "pe", "ra", "si", "to", "ve", "zu", "dra", "fen", "gol", "hix", "jup", "qua"]
+    # Every topic gets its own made-up terms so coverage can be checked by which pages a chunk spans
+    vocabularies = [
+        ["".join(rng.choice(syllables) for _ in range(3)) + "abcdefghijklmnopqrstuvwxyz"[topic % 26] for _ in range(120)]
+        for topic in range(num_topics)
+    ]
+    all_terms = [term for vocabulary in vocabularies for term in vocabulary]
+    filler_pages = int(num_pages * back_matter_share)
+    prose_pages = num_pages - filler_pages
+    pages, topics = [], []
+    for page in range(prose_pages):
+        topic = page * num_topics // prose_pages
+        pages.append(prose_page(rng, vocabularies[topic]))
+        topics.append(topic)
+    for page in range(filler_pages):
+        pages.append(filler_page(rng, all_terms, "index" if page % 2 else "bibliography"))
+        topics.append(None)
+    return pages, topics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare sending every chunk with salience-based chunk selection")
+    parser.add_argument("--pages", type=int, nargs="+", default=[50, 500])
+    parser.add_argument("--topics", type=int, default=12)
+    parser.add_argument("--questions", type=int, default=40)
+    args = parser.parse_args()
+
+    print(f"{'pages':>6} {'chunks':>7} {'all req':>8} {'sel req':>8} {'all tok':>9} {'sel tok':>9} {'topics':>7} {'filler':>7} {'select s':>9}")
+    for num_pages in args.pages:
+        pages, page_topics = make_book(num_pages, args.topics)
+        chunks = list(iter_chunks(pages))
+        every = allocate_questions(chunks, args.questions)
+
+        start = time.perf_counter()
+        selected, weights = select_salient_chunks(chunks, args.questions)
+        seconds = time.perf_counter() - start
+        allocation = allocate_questions([chunks[i] for i in selected], args.questions, weights)
+        sent = [i for i, count in zip(selected, allocation) if count]
+
+        covered = {page_topics[page - 1] for i in sent for page in range(chunks[i].page_start, chunks[i].page_end + 1)}
+        filler = sum(1 for i in sent if page_topics[chunks[i].page_start - 1] is None)
+        print(
+            f"{num_pages:>6} {len(chunks):>7} {sum(1 for count in every if count):>8} {len(sent):>8} "
+            f"{sum(chunk.tokens for chunk, count in zip(chunks, every) if count):>9} {sum(chunks[i].tokens for i in sent):>9} "
+            f"{len(covered - {None})}/{args.topics:<5} {filler:>7} {seconds:>9.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+HEAVY_MODULES = ["pandas", "numpy", "fitz", "pymupdf", "openai", "tiktoken"]
+
+# Runs in a fresh interpreter so every measurement is a true cold start
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import streamlit
+streamlit_seconds = time.perf_counter() - start
+sys.path.insert(0, {here!r})
+start = time.perf_counter()
+import importlib
+importlib.import_module({module!r})
+module_seconds = time.perf_counter() - start
+print(json.dumps({{
+    "streamlit_import": streamlit_seconds,
+    "module_import": module_seconds,
+    "heavy_loaded": [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+RENDER_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+streamlit_seconds = time.perf_counter() - start
+start = time.perf_counter()
+app = AppTest.from_file({script!r}, default_timeout=120)
+app.run()
+render_seconds = time.perf_counter() - start
+print(json.dumps({{
+    "streamlit_import": streamlit_seconds,
+    "first_render": render_seconds,
+    "exceptions": len(app.exception),
+    "heavy_loaded": [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+
+# Function to run a probe in a fresh interpreter and return its JSON report plus total process time
+def run_probe(code, env):
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env, cwd=HERE)
+    elapsed = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "probe failed")
+    report = json.loads(completed.stdout.strip().splitlines()[-1])
+    report["process"] = elapsed
+    return report
+
+
+# Function to take the median of each timing across repeated cold starts
+def summarise(reports):
+    keys = [key for key, value in reports[0].items() if isinstance(value, float)]
+    summary = {key: statistics.median(report[key] for report in reports) for key in keys}
+    summary["heavy_loaded"] = reports[-1]["heavy_loaded"]
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold-start import time and time to first render")
+    parser.add_argument("--script", default="examtool_V05.py", help="Streamlit script to measure")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    script = os.path.join(HERE, args.script)
+    module = os.path.splitext(os.path.basename(script))[0]
+    env = dict(os.environ)
+    # First render must not stop at the API key check, which would skip most of the page
+    env.setdefault("OPENAI_API_KEY", "sk-startup-benchmark")
+
+    print(f"Cold start for {args.script} (median of {args.repeats} fresh processes)")
+    if module.isidentifier():
+        imports = summarise([
+            run_probe(IMPORT_PROBE.format(here=HERE, module=module, heavy=HEAVY_MODULES), env)
+            for _ in range(args.repeats)
+        ])
+        print(f"  streamlit import:     {imports['streamlit_import']:.3f}s")
+        print(f"  module import:        {imports['module_import']:.3f}s")
+        print(f"  import process total: {imports['process']:.3f}s")
+        print(f"  heavy modules loaded: {', '.join(imports['heavy_loaded']) or 'none'}")
+
+    renders = summarise([
+        run_probe(RENDER_PROBE.format(script=script, heavy=HEAVY_MODULES), env)
+        for _ in range(args.repeats)
+    ])
+    print(f"  time to first render: {renders['first_render']:.3f}s")
+    print(f"  render process total: {renders['process']:.3f}s")
+    print(f"  heavy modules loaded: {', '.join(renders['heavy_loaded']) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,32 @@
 import streamlit as st
-import pandas as pd
-import numpy as np
-import fitz  # PyMuPDF
-import openai
 import time
-import re
 import os
+import uuid
+
+from examtool_pipeline import (
+    DEFAULT_CHUNK_OVERLAP_TOKENS,
+    DEFAULT_CHUNK_TOKENS,
+    DEFAULT_CONCURRENCY,
+    REQUESTS_PER_MINUTE,
+    TOKENS_PER_MINUTE,
+    TOP_UP_MAX_SECONDS,
+    TOP_UP_MAX_TOKENS,
+    FakeBackend,
+    Instrumentation,
+    OpenAIBackend,
+    QuestionTimer,
+    ScoringEngine,
+    build_quiz,
+    get_request_scheduler,
+    get_shared_quiz_store,
+    pdf_digest,
+    quiz_build_complete,
+    record_attempt,
+    shared_quiz_key,
+)
+
+# Questions rendered per quiz page; only the current page's widgets exist on each rerun
+DEFAULT_QUESTIONS_PER_PAGE = 10
 
 st.set_page_config(page_title="PDF Quiz Generator", layout="wide")
 
@@ -50,90 +71,59 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Function to extract text from PDF
-def extract_text_from_pdf(file):
-    text = ""
-    try:
-        pdf_document = fitz.open(stream=file.read(), filetype="pdf")
-        for page in pdf_document:
-            text += page.get_text()
-    except Exception as e:
-        st.error(f"Error extracting text from PDF: {e}")
-    return text
-
-# Function to chunk text to avoid token limit
-def chunk_text(text, chunk_size=1000):
-    return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
-
-# Function to generate questions using OpenAI API
-def generate_questions(text, num_questions, difficulty, model, api_key):
-    openai.api_key = api_key
-
-    messages = [
-        {"role": "system", "content": "You are a helpful assistant that creates multiple-choice questions."},
-        {"role": "user", "content": f"""
-Extract {num_questions} multiple-choice questions from the text below with {difficulty} difficulty level.
-Each question should follow this format:
-1. Question text
-A) Option 1
-B) Option 2
-C) Option 3
-D) Option 4
-Correct Answer: X (where X is A, B, C, or D)
-
-Text:
-{text}
-"""}
-    ]
-
-    try:
-        response = openai.ChatCompletion.create(
-            model=model,
-            messages=messages,
-            max_tokens=10000
-        )
-        return response["choices"][0]["message"]["content"]
-    except Exception as e:
-        st.error(f"Error generating questions: {e}")
-        return ""
-
-# Function to parse generated questions into a structured format
-def parse_questions(raw_questions):
-    questions = []
-    for question in raw_questions.split("\n\n"):
-        if question.strip():
-            try:
-                parts = question.split("\n")
-                q = parts[0].strip()  # Question text
-                options = []
-                correct_answer = None
-
-                # Extract options and clean them
-                for option in parts[1:]:
-                    match = re.match(r"^[A-D]\)", option.strip())  # Match options A), B), C), D)
-                    if match:
-                        options.append(option.strip())
-
-                # Extract correct answer (e.g., "Correct Answer: C")
-                correct_match = re.search(r"Correct Answer:\s*([A-D])", " ".join(parts))
-                if correct_match:
-                    correct_letter = correct_match.group(1)
-                    correct_answer = next((opt for opt in options if opt.startswith(f"{correct_letter})")), None)
-
-                # Validate the extracted question
-                if len(options) == 4 and correct_answer:
-                    questions.append({
-                        "question": q,
-                        "options": options,
-                        "correct": correct_answer
-                    })
-                else:
-                    st.warning(f"Skipping invalid question: {q}")
-            except Exception as e:
-                st.warning(f"Error parsing question: {question}")
-                st.write(f"Error Details: {e}")
-
-    return questions
+# Function to show per-question time percentiles and the questions that took longest
+def render_timing_breakdown(report, questions):
+    if not report["per_question"]:
+        # Questions sharing a page share its visit times, so there is no slowest question to point at
+        st.subheader("Time per page visit")
+        st.caption("Questions were shown several to a page, so each time covers a whole page. "
+                   "Set questions per page to 1 for times per question.")
+        labels = (("dwell", "Page on screen"), ("latency", "Page first shown to answer submitted"))
+    else:
+        st.subheader("Time per question")
+        labels = (("dwell", "Time on screen"), ("latency", "First view to answer"))
+    st.table([
+        {"Measure": label, **{f"p{p}": f"{seconds:.1f} s" for p, seconds in report[measure].items()}}
+        for measure, label in labels
+        if report[measure]
+    ])
+    if report["per_question"]:
+        for i, seconds in report["slowest"]:
+            st.caption(f"Q{i + 1} ({seconds:.1f} s on screen): {questions[i]['question']}")
+
+# Function to show where the attempt lost marks, per topic and per difficulty
+def render_score_breakdown(report):
+    if report["unanswered"]:
+        st.caption(f"{report['unanswered']} of {report['questions']} questions were left unanswered and scored wrong")
+    topic_col, difficulty_col = st.columns(2)
+    for column, title, rows in (
+        (topic_col, "By topic", report["by_topic"]),
+        (difficulty_col, "By difficulty", report["by_difficulty"]),
+    ):
+        with column:
+            st.subheader(title)
+            st.table([
+                {title[3:].capitalize(): row["group"], "Correct": f"{row['correct']}/{row['questions']}", "Score": f"{row['rate']:.0%}"}
+                for row in rows
+            ])
+
+# Function to show the metrics of the last generation in the sidebar
+def render_metrics_panel(summary):
+    with st.sidebar.expander("Last generation metrics", expanded=False):
+        for stage, seconds in summary["stages"].items():
+            st.write(f"**{stage}**: {seconds:.2f} s")
+        st.write(f"**Chunks sent**: {summary['chunks']} ({summary['cached_chunks']} from cache)")
+        st.write(f"**Slowest chunk**: {summary['slowest_chunk_seconds']:.2f} s")
+        st.write(f"**Tokens**: {summary['prompt_tokens']} prompt / {summary['completion_tokens']} completion")
+        st.write(f"**Estimated cost**: ${summary['cost_usd']:.4f}")
+        if summary["parse_yield"] is not None:
+            st.write(
+                f"**Parse yield**: {summary['parse_yield']:.0%} "
+                f"({summary['questions_parsed']} kept, {summary['questions_skipped']} discarded)"
+            )
+            for output_format, parse_yield in summary["parse_yield_by_format"].items():
+                st.caption(f"{output_format} output: {parse_yield:.0%} of questions kept")
+        st.caption(f"Run {summary['run_id']}")
 
 # Streamlit App
 def main():
@@ -146,6 +136,12 @@ def main():
         st.session_state["start_time"] = None
     if "results_displayed" not in st.session_state:
         st.session_state["results_displayed"] = False
+    if "answers" not in st.session_state:
+        st.session_state["answers"] = None
+    if "scoring" not in st.session_state:
+        st.session_state["scoring"] = None
+    if "quiz_page" not in st.session_state:
+        st.session_state["quiz_page"] = 0
 
     uploaded_file = st.file_uploader("Upload your PDF file", type="pdf")
 
@@ -157,63 +153,236 @@ def main():
     with col3:
         model = st.selectbox("Select Model", ["gpt-3.5-turbo"])
 
-    # Securely load API key
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        st.error("OpenAI API key is not configured. Set the key as an environment variable.")
-        return
+    max_workers = st.sidebar.number_input(
+        "Concurrent API requests", min_value=1, max_value=32, value=DEFAULT_CONCURRENCY,
+        help="Number of PDF chunks sent to the model at the same time"
+    )
+    chunk_tokens = st.sidebar.number_input(
+        "Chunk size (tokens)", min_value=200, max_value=16000, value=DEFAULT_CHUNK_TOKENS, step=100,
+        help="Paragraphs and sentences are packed into chunks up to this many tokens"
+    )
+    overlap_tokens = st.sidebar.number_input(
+        "Chunk overlap (tokens)", min_value=0, max_value=int(chunk_tokens) // 2, value=DEFAULT_CHUNK_OVERLAP_TOKENS, step=50,
+        help="Tokens of trailing context repeated at the start of the next chunk"
+    )
+    scheduler = get_request_scheduler()
+    st.sidebar.caption(
+        f"Rate limits: {REQUESTS_PER_MINUTE} requests and {TOKENS_PER_MINUTE} tokens per minute. "
+        f"Queued: {scheduler.queue_depth}, in flight: {scheduler.in_flight}, retries so far: {scheduler.retries}"
+    )
+    shared_store = get_shared_quiz_store()
+    st.sidebar.caption(
+        f"Shared quizzes: {shared_store.builds} generated, {shared_store.hits} reused, "
+        f"{shared_store.waits} joined while in progress"
+    )
+    stream_responses = st.sidebar.checkbox(
+        "Stream responses", value=False,
+        help="Show each question as soon as the model finishes writing it"
+    )
+    use_cache = st.sidebar.checkbox(
+        "Reuse cached responses", value=True,
+        help="Return stored answers for chunks that were already generated with the same settings"
+    )
+    questions_per_page = st.sidebar.number_input(
+        "Questions per page", min_value=1, max_value=200, value=DEFAULT_QUESTIONS_PER_PAGE,
+        help="Only one page of questions is rendered at a time"
+    )
+    output_format = st.sidebar.selectbox(
+        "Question format", ["text", "json"],
+        format_func=lambda name: {"text": "Numbered text", "json": "Structured JSON (function calling)"}[name],
+        help="Structured JSON asks the model to fill a schema, so fewer generated questions are thrown away"
+    )
+    select_chunks = st.sidebar.checkbox(
+        "Send only the most informative chunks", value=True,
+        help="Skip indexes, bibliographies and repeated material, sending one representative chunk per topic"
+    )
+    top_up = st.sidebar.checkbox(
+        "Top up to the requested count", value=True,
+        help=f"Ask again for questions that were discarded, within {TOP_UP_MAX_TOKENS} tokens and {TOP_UP_MAX_SECONDS:.0f} seconds"
+    )
+    use_bank = st.sidebar.checkbox(
+        "Use question bank", value=True,
+        help="Build the quiz from previously generated questions for this PDF when enough are stored"
+    )
+
+    backend_names = ["OpenAI", "Local fake (offline)"]
+    backend_choice = st.sidebar.selectbox(
+        "Model backend", backend_names,
+        index=1 if os.getenv("EXAMTOOL_BACKEND") == "fake" else 0,
+        help="The local fake backend writes deterministic questions without network access"
+    )
+    if backend_choice == "OpenAI":
+        # Securely load API key
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            st.error("OpenAI API key is not configured. Set the key as an environment variable.")
+            return
+        backend = OpenAIBackend(api_key)
+    else:
+        with st.sidebar.expander("Fake backend settings"):
+            backend = FakeBackend(
+                latency=st.number_input("Latency per request (s)", min_value=0.0, value=0.2, step=0.1),
+                tokens_per_second=st.number_input("Throughput (tokens/s)", min_value=1.0, value=200.0, step=50.0),
+                failure_rate=st.slider("Failure rate", 0.0, 1.0, 0.0),
+                malformed_rate=st.slider("Malformed question rate", 0.0, 1.0, 0.05)
+            )
 
     if uploaded_file is not None and st.button("Generate Quiz"):
         with st.spinner("Extracting text and generating questions..."):
-            pdf_text = extract_text_from_pdf(uploaded_file)
-
-            if pdf_text.strip():
-                chunks = chunk_text(pdf_text)
-                raw_questions = ""
-                for chunk in chunks:
-                    raw_questions += generate_questions(chunk, num_questions, difficulty, model, api_key) + "\n"
-
-                questions = parse_questions(raw_questions)
-
-                st.session_state["questions"] = questions
+            st.session_state["questions"] = []
+            st.session_state["results_displayed"] = False
+            st.session_state["answers"] = None
+            st.session_state["scoring"] = None
+            st.session_state["quiz_page"] = 0
+            progress = st.empty()
+            # Questions are previewed as they stream in; the answerable quiz replaces the preview once generation ends
+            preview = st.empty()
+            preview_box = preview.container()
+            metrics = Instrumentation()
+
+            def show_question(question):
+                # Questions appear in the session as soon as they are parsed
+                st.session_state["questions"].append(question)
+                count = len(st.session_state["questions"])
+                progress.info(
+                    f"{count} questions generated so far "
+                    f"({get_request_scheduler().queue_depth} requests waiting for rate limits)."
+                )
+                with preview_box:
+                    st.markdown(f"**Q{count}: {question['question']}**")
+                    st.caption("  \n".join(question["options"]))
+
+            pdf_bytes = uploaded_file.read()
+            generate = lambda: build_quiz(
+                pdf_bytes, num_questions, difficulty, model, backend, max_workers,
+                chunk_tokens, overlap_tokens, use_cache, stream_responses, metrics, show_question, use_bank, select_chunks,
+                output_format, top_up
+            )
+            digest = pdf_digest(pdf_bytes)
+            st.session_state["quiz_info"] = {"doc_hash": digest, "difficulty": difficulty, "model": model}
+            if use_cache:
+                # A class opening the same PDF with the same settings shares one generation
+                key = shared_quiz_key(
+                    digest, num_questions, difficulty, model, backend, chunk_tokens, overlap_tokens, select_chunks,
+                    output_format, top_up, use_bank
+                )
+                with metrics.span("shared_quiz") as record:
+                    questions, built = shared_store.get_or_build(
+                        key, generate, lambda questions: quiz_build_complete(questions, num_questions, metrics)
+                    )
+                    record["hit"] = not built
+            else:
+                questions = generate()
+            progress.empty()
+            preview.empty()
+            metrics.emit_jsonl()
+            st.session_state["metrics"] = metrics.summary()
+
+            if questions is not None:
+                # Sessions share the question dicts read-only but each keeps its own list
+                st.session_state["questions"] = list(questions)
                 st.session_state["start_time"] = time.time()
-                st.session_state["results_displayed"] = False
             else:
                 st.error("No text could be extracted from the PDF. Please try a different file.")
 
     if "questions" in st.session_state and st.session_state["questions"]:
         st.header("Quiz")
-        user_answers = []
-        for i, question in enumerate(st.session_state["questions"]):
-            st.subheader(f"Q{i + 1}: {question['question']}")
-            answer = st.radio(
-                label=f"Choose the correct answer for Q{i + 1}",
-                options=question["options"],
-                key=f"question_{i}"
-            )
-            user_answers.append({"question": question, "selected": answer})
-
-        if st.button("Submit"):
+        questions = st.session_state["questions"]
+        engine = st.session_state["scoring"]
+        if engine is None or len(engine.key) != len(questions):
+            # Answer key and responses are option indices, built once per quiz
+            engine = st.session_state["scoring"] = ScoringEngine(questions)
+            st.session_state["answers"] = engine.blank_responses()
+            st.session_state["timer"] = QuestionTimer(len(questions), st.session_state["start_time"])
+        answers = st.session_state["answers"]
+        timer = st.session_state["timer"]
+        page_count = (len(questions) + questions_per_page - 1) // questions_per_page
+        page = min(st.session_state["quiz_page"], page_count - 1)
+        start = page * questions_per_page
+        stop = min(start + questions_per_page, len(questions))
+        if not st.session_state["results_displayed"]:
+            timer.page_shown(start, stop)
+
+        # Answers inside a form cost nothing until one of its buttons is pressed
+        with st.form(f"quiz_page_{page}"):
+            st.caption(f"Page {page + 1} of {page_count} (questions {start + 1}-{stop} of {len(questions)})")
+            selected = {}
+            for i in range(start, stop):
+                question = questions[i]
+                st.subheader(f"Q{i + 1}: {question['question']}")
+                # Unanswered questions show no selection, so an untouched radio never counts as a choice
+                choice = st.radio(
+                    label=f"Choose the correct answer for Q{i + 1}",
+                    options=question["options"],
+                    index=int(answers[i]) if answers[i] >= 0 else None,
+                    key=f"question_{i}"
+                )
+                if choice is not None:
+                    selected[i] = question["options"].index(choice)
+            nav_col1, nav_col2, nav_col3 = st.columns(3)
+            with nav_col1:
+                previous_page = st.form_submit_button("Previous page", disabled=page == 0)
+            with nav_col2:
+                next_page = st.form_submit_button("Next page", disabled=page >= page_count - 1)
+            with nav_col3:
+                submitted = st.form_submit_button("Submit")
+
+        if previous_page or next_page or submitted:
+            timer.page_left([i for i, choice in selected.items() if answers[i] != choice])
+            answers[list(selected)] = list(selected.values())
+        if previous_page or next_page:
+            st.session_state["quiz_page"] = page + (1 if next_page else -1)
+            st.rerun()
+
+        user_answers = [
+            {"question": question, "selected": question["options"][answers[i]] if answers[i] >= 0 else None}
+            for i, question in enumerate(questions)
+        ]
+
+        if submitted:
             with st.spinner("Evaluating your answers..."):
-                correct_answers = sum(1 for ans in user_answers if ans["selected"] == ans["question"]["correct"])
+                # Questions never answered stay UNANSWERED and are scored wrong
+                report = engine.report(answers)
                 total_time = time.time() - st.session_state["start_time"]
 
-                st.session_state["correct_answers"] = correct_answers
+                st.session_state["score_report"] = report
+                st.session_state["timing_report"] = timer.report()
+                try:
+                    record_attempt({
+                        "attempt_id": uuid.uuid4().hex,
+                        **st.session_state.get("quiz_info", {}),
+                        "questions": report["questions"],
+                        "correct": report["correct"],
+                        "percentage": report["mean_percentage"],
+                        "total_seconds": total_time,
+                        "dwell_p50": st.session_state["timing_report"]["dwell"].get(50),
+                        "dwell_p90": st.session_state["timing_report"]["dwell"].get(90),
+                    })
+                except (ImportError, OSError) as e:
+                    st.warning(f"Could not save this attempt to the history: {e}")
+                st.session_state["correct_answers"] = report["correct"]
                 st.session_state["total_time"] = total_time
                 st.session_state["results_displayed"] = True
 
     if "results_displayed" in st.session_state and st.session_state["results_displayed"]:
         st.success("Overview Metrics")
+        # Score against the questions actually shown, which can differ from the number requested
+        total_questions = len(st.session_state["questions"])
         metrics_col1, metrics_col2, metrics_col3, metrics_col4 = st.columns(4)
 
         with metrics_col1:
-            st.markdown(f"<h4 class='card'>Correct Answers<br><br><span class='metric-value'>{st.session_state['correct_answers']}/{num_questions}</span></h4>", unsafe_allow_html=True)
+            st.markdown(f"<h4 class='card'>Correct Answers<br><br><span class='metric-value'>{st.session_state['correct_answers']}/{total_questions}</span></h4>", unsafe_allow_html=True)
         with metrics_col2:
-            st.markdown(f"<h4 class='card'>Percentage<br><br><span class='metric-value'>{(st.session_state['correct_answers'] / num_questions) * 100:.2f}%</span></h4>", unsafe_allow_html=True)
+            st.markdown(f"<h4 class='card'>Percentage<br><br><span class='metric-value'>{(st.session_state['correct_answers'] / total_questions) * 100:.2f}%</span></h4>", unsafe_allow_html=True)
         with metrics_col3:
             st.markdown(f"<h4 class='card'>Total Time<br><br><span class='metric-value'>{st.session_state['total_time']:.2f} seconds</span></h4>", unsafe_allow_html=True)
         with metrics_col4:
-            st.markdown(f"<h4 class='card'>Avg. Time per Question<br><br><span class='metric-value'>{st.session_state['total_time'] / num_questions:.2f} seconds</span></h4>", unsafe_allow_html=True)
+            st.markdown(f"<h4 class='card'>Avg. Time per Question<br><br><span class='metric-value'>{st.session_state['total_time'] / total_questions:.2f} seconds</span></h4>", unsafe_allow_html=True)
+
+        if st.session_state.get("score_report"):
+            render_score_breakdown(st.session_state["score_report"])
+        if st.session_state.get("timing_report"):
+            render_timing_breakdown(st.session_state["timing_report"], st.session_state["questions"])
 
         if st.button("Show Correct Answers"):
             st.header("Correct Answers")
@@ -224,10 +393,13 @@ def main():
                 color = "green" if selected == correct else "red"
                 st.markdown(
                     f"<p><strong>Q{i + 1}: {question['question']}</strong><br>"
-                    f"Your Answer: <span style='color: {color};'>{selected}</span><br>"
+                    f"Your Answer: <span style='color: {color};'>{selected or 'Unanswered'}</span><br>"
                     f"Correct Answer: <span style='color: green;'>{correct}</span></p>",
                     unsafe_allow_html=True
                 )
 
+    if st.session_state.get("metrics"):
+        render_metrics_panel(st.session_state["metrics"])
+
 if __name__ == "__main__":
     main()
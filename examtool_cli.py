@@ -0,0 +1,174 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import examtool_pipeline as examtool
+
+
+# Function to split the account rate limits and the cores between worker processes, run once per worker
+def init_batch_worker(workers, log_level):
+    # Pipeline warnings and errors go to stderr only when asked for; failures are summarised per file either way
+    logging.basicConfig(level=log_level, format="%(levelname)s %(message)s")
+    examtool.REQUESTS_PER_MINUTE = max(1, examtool.REQUESTS_PER_MINUTE // workers)
+    examtool.TOKENS_PER_MINUTE = max(1, examtool.TOKENS_PER_MINUTE // workers)
+    # Each PDF worker gets its share of the cores for extracting long documents
+    examtool.EXTRACTION_WORKERS = max(1, (os.cpu_count() or 1) // workers)
+    examtool.get_request_scheduler.clear()
+
+
+# Function to generate the questions for one PDF inside a worker process
+def generate_for_file(path, source, settings):
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        pdf_bytes = f.read()
+    backend = examtool.FakeBackend() if settings["backend"] == "fake" else examtool.OpenAIBackend(os.getenv("OPENAI_API_KEY"))
+    metrics = examtool.Instrumentation()
+    questions = examtool.build_quiz(
+        pdf_bytes, settings["num_questions"], settings["difficulty"], settings["model"], backend,
+        settings["concurrency"], settings["chunk_tokens"], settings["overlap_tokens"],
+        settings["use_cache"], False, metrics, None, settings["use_bank"], settings["select_chunks"],
+        settings["output_format"], settings["top_up"]
+    )
+    metrics.emit_jsonl()
+    # build_quiz reports problems instead of raising, so collect them from its result and the chunk records
+    problems = [record["error"] for record in metrics.records if record.get("error")]
+    if questions is None:
+        problems.insert(0, "no text could be extracted")
+    doc_hash = examtool.pdf_digest(pdf_bytes)
+    rows = [
+        {
+            "source": source,
+            "doc_hash": doc_hash,
+            "difficulty": settings["difficulty"],
+            "model": settings["model"],
+            "question": q["question"],
+            "options": q["options"],
+            "correct": q["correct"],
+            "chunk": q.get("chunk"),
+            "page_start": q.get("page_start"),
+            "page_end": q.get("page_end"),
+        }
+        for q in questions or []
+    ]
+    return rows, problems, time.perf_counter() - start
+
+
+# Function to list the PDFs to process, relative to the input directory
+def find_pdfs(input_dir, recursive):
+    if recursive:
+        paths = [os.path.join(root, name) for root, _, files in os.walk(input_dir) for name in files]
+    else:
+        paths = [os.path.join(input_dir, name) for name in os.listdir(input_dir)]
+    return sorted(path for path in paths if path.lower().endswith(".pdf") and os.path.isfile(path))
+
+
+# Function to write the collected rows as a Parquet file
+def write_parquet(rows, output):
+    try:
+        import pandas as pd
+        pd.DataFrame(rows).to_parquet(output, index=False)
+    except ImportError as e:
+        sys.exit(f"Parquet output needs pandas and pyarrow: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate quizzes for every PDF in a directory without the Streamlit UI")
+    parser.add_argument("input_dir", help="Directory containing PDF files")
+    parser.add_argument("-o", "--output", required=True, help="Output file (.jsonl or .parquet)")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], help="Output format; inferred from the output extension by default")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Also process PDFs in subdirectories")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="Number of PDFs processed in parallel")
+    parser.add_argument("-n", "--num-questions", type=int, default=10)
+    parser.add_argument("--difficulty", choices=["Easy", "Medium", "Hard"], default="Medium")
+    parser.add_argument("--model", default="gpt-3.5-turbo")
+    parser.add_argument("--backend", choices=["openai", "fake"], default=os.getenv("EXAMTOOL_BACKEND", "openai"))
+    parser.add_argument("--concurrency", type=int, default=examtool.DEFAULT_CONCURRENCY, help="Concurrent model requests per PDF")
+    parser.add_argument("--chunk-tokens", type=int, default=examtool.DEFAULT_CHUNK_TOKENS)
+    parser.add_argument("--overlap-tokens", type=int, default=examtool.DEFAULT_CHUNK_OVERLAP_TOKENS)
+    parser.add_argument("--no-cache", action="store_true", help="Ignore cached model responses")
+    parser.add_argument("--no-bank", action="store_true", help="Always generate instead of reusing the question bank")
+    parser.add_argument("--output-format", choices=["text", "json"], default="text",
+                        help="Ask for numbered text, or for structured JSON through function calling")
+    parser.add_argument("--no-top-up", action="store_true", help="Accept fewer questions than requested instead of asking again")
+    parser.add_argument("--all-chunks", action="store_true", help="Send every chunk instead of one representative chunk per topic")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Also print pipeline warnings and errors as they happen")
+    args = parser.parse_args()
+
+    output_format = args.format or ("parquet" if args.output.lower().endswith(".parquet") else "jsonl")
+    if args.backend == "openai" and not os.getenv("OPENAI_API_KEY"):
+        sys.exit("OpenAI API key is not configured. Set OPENAI_API_KEY or use --backend fake.")
+    paths = find_pdfs(args.input_dir, args.recursive)
+    if not paths:
+        sys.exit(f"No PDF files found in {args.input_dir}")
+
+    settings = {
+        "num_questions": args.num_questions,
+        "difficulty": args.difficulty,
+        "model": args.model,
+        "backend": args.backend,
+        "concurrency": args.concurrency,
+        "chunk_tokens": args.chunk_tokens,
+        "overlap_tokens": args.overlap_tokens,
+        "use_cache": not args.no_cache,
+        "use_bank": not args.no_bank,
+        "select_chunks": not args.all_chunks,
+        "output_format": args.output_format,
+        "top_up": not args.no_top_up,
+    }
+    workers = max(1, min(args.workers, len(paths)))
+    start = time.perf_counter()
+    all_rows = []
+    failures = 0
+    jsonl_file = open(args.output, "w", encoding="utf-8") if output_format == "jsonl" else None
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_batch_worker,
+                                 initargs=(workers, logging.WARNING if args.verbose else logging.CRITICAL)) as executor:
+            futures = {
+                executor.submit(generate_for_file, path, os.path.relpath(path, args.input_dir), settings): path
+                for path in paths
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                source = os.path.relpath(futures[future], args.input_dir)
+                try:
+                    rows, problems, seconds = future.result()
+                except Exception as e:
+                    failures += 1
+                    print(f"[{done}/{len(paths)}] {source}: failed ({e})", file=sys.stderr)
+                    continue
+                if problems:
+                    # Questions from the chunks that did succeed are still written
+                    failures += 1
+                    more = f" and {len(problems) - 1} more" if len(problems) > 1 else ""
+                    print(
+                        f"[{done}/{len(paths)}] {source}: failed ({problems[0]}{more}); {len(rows)} questions kept",
+                        file=sys.stderr
+                    )
+                else:
+                    print(f"[{done}/{len(paths)}] {source}: {len(rows)} questions in {seconds:.1f}s", file=sys.stderr)
+                if jsonl_file is not None:
+                    # Rows are written as each file finishes so a long batch keeps partial results
+                    jsonl_file.writelines(json.dumps(row) + "\n" for row in rows)
+                    jsonl_file.flush()
+                else:
+                    all_rows.extend(rows)
+    finally:
+        if jsonl_file is not None:
+            jsonl_file.close()
+    if output_format == "parquet":
+        write_parquet(all_rows, args.output)
+
+    print(
+        f"Processed {len(paths) - failures} of {len(paths)} PDFs with {workers} workers "
+        f"in {time.perf_counter() - start:.1f}s; output written to {args.output}",
+        file=sys.stderr
+    )
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
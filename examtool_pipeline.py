@@ -0,0 +1,1855 @@
+import streamlit as st
+import abc
+import logging
+import time
+import re
+import os
+import threading
+import tracemalloc
+import hashlib
+import json
+import functools
+import mmap
+import multiprocessing
+import sqlite3
+import queue
+import random
+import uuid
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timezone
+from collections import Counter, OrderedDict, deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# PyMuPDF, openai, numpy and tiktoken are imported inside the functions that need them,
+# so a fresh process can render the upload page before any of them are loaded
+
+# Default number of chunks sent to the API at the same time
+DEFAULT_CONCURRENCY = 4
+
+# Token budget per chunk sent to the model, and how many tokens consecutive chunks share
+DEFAULT_CHUNK_TOKENS = 2000
+DEFAULT_CHUNK_OVERLAP_TOKENS = 0
+
+# Documents with at least this many pages are split across worker processes for extraction
+PARALLEL_EXTRACTION_MIN_PAGES = 64
+# Extraction processes per document; None uses every core
+EXTRACTION_WORKERS = None
+
+# With chunk selection on, about this many questions are asked of each chunk sent to the model
+SALIENCE_QUESTIONS_PER_CHUNK = 3
+SALIENCE_MAX_VOCABULARY = 4096
+
+# Limits on asking again for questions the first pass failed to deliver
+TOP_UP_MAX_ROUNDS = 3
+TOP_UP_MAX_SECONDS = float(os.getenv("EXAMTOOL_TOP_UP_SECONDS", 60))
+TOP_UP_MAX_TOKENS = int(os.getenv("EXAMTOOL_TOP_UP_TOKENS", 20000))
+
+# Account rate limits shared by every model call from this server process
+REQUESTS_PER_MINUTE = int(os.getenv("EXAMTOOL_REQUESTS_PER_MINUTE", 3500))
+TOKENS_PER_MINUTE = int(os.getenv("EXAMTOOL_TOKENS_PER_MINUTE", 90000))
+MAX_RETRIES = int(os.getenv("EXAMTOOL_MAX_RETRIES", 6))
+# Completion cap per requested question plus a margin for preamble; the API counts max_tokens against the
+# per-minute limit, so the same cap is what gets reserved before the real usage is known
+COMPLETION_TOKENS_PER_QUESTION = 120
+COMPLETION_TOKENS_MARGIN = 100
+
+# Bump whenever the prompt in generate_questions changes so stale cached responses are ignored
+PROMPT_VERSION = "1"
+
+# Local on-disk cache for model responses
+CACHE_DIR = os.getenv("EXAMTOOL_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".examtool_cache"))
+RESPONSE_CACHE_DIR = os.path.join(CACHE_DIR, "responses")
+TEXT_CACHE_DIR = os.path.join(CACHE_DIR, "text")
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("EXAMTOOL_RESPONSE_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+# Eviction trims the cache to this fraction of its limit
+RESPONSE_CACHE_EVICT_FRACTION = 0.9
+_response_cache_lock = threading.Lock()
+# Bytes in the response cache as of the last walk plus what this process has written since; None until the first walk
+_response_cache_bytes = None
+QUESTION_BANK_PATH = os.getenv("EXAMTOOL_QUESTION_BANK", os.path.join(CACHE_DIR, "question_bank.sqlite3"))
+
+# Finished quizzes kept in memory for every session on this server, most recently used first
+SHARED_QUIZ_MAX_ENTRIES = int(os.getenv("EXAMTOOL_SHARED_QUIZZES", 64))
+
+# Submitted attempts as Parquet files under date=YYYY-MM-DD partitions; a day is merged into one file at this many files
+ATTEMPT_HISTORY_DIR = os.getenv("EXAMTOOL_ATTEMPT_HISTORY", os.path.join(CACHE_DIR, "attempts"))
+ATTEMPT_HISTORY_COMPACT_FILES = 64
+
+# Structured per-stage metrics are appended here as JSON lines
+METRICS_LOG_PATH = os.getenv("EXAMTOOL_METRICS_LOG", os.path.join(CACHE_DIR, "metrics.jsonl"))
+# USD per 1,000 prompt and completion tokens, used for cost estimates
+MODEL_PRICING = {
+    "gpt-3.5-turbo": (0.0015, 0.002),
+    "gpt-4": (0.03, 0.06),
+}
+
+logger = logging.getLogger(__name__)
+
+# Function to report a problem on the running Streamlit page, or to the log when there is no page (CLI, benchmarks)
+def notify(level, message):
+    if get_script_run_ctx(suppress_warning=True) is not None:
+        getattr(st, level)(message)
+    else:
+        getattr(logger, level)(message)
+
+_worker_pdf_document = None
+
+# Function to open the shared PDF bytes when an extraction worker starts
+def init_extraction_worker(pdf_bytes):
+    global _worker_pdf_document
+    import fitz  # PyMuPDF
+    _worker_pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
+
+# Function to extract the text of pages [start, stop) inside an extraction worker
+def extract_page_range(page_range):
+    start, stop = page_range
+    return [_worker_pdf_document[i].get_text() for i in range(start, stop)]
+
+# Function to split page extraction across a process pool, returning page texts in order
+def extract_pages_in_parallel(pdf_bytes, page_count, workers):
+    # A few ranges per worker keeps the pool busy when some pages are much denser than others
+    num_ranges = min(page_count, workers * 4)
+    bounds = [page_count * i // num_ranges for i in range(num_ranges + 1)]
+    page_ranges = list(zip(bounds[:-1], bounds[1:]))
+    # Streamlit serves each session from its own thread, and forking a threaded process can copy a lock
+    # another thread holds into the worker, so workers start from a clean forkserver process instead.
+    # The server imports this module and PyMuPDF once, so each worker starts without importing them again.
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context("forkserver")
+        mp_context.set_forkserver_preload([__name__, "fitz"])
+    else:
+        mp_context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=init_extraction_worker,
+                             initargs=(pdf_bytes,)) as executor:
+        return [page_text for pages in executor.map(extract_page_range, page_ranges) for page_text in pages]
+
+# Function to extract the text of every page, using a process pool for long documents
+def extract_pages(pdf_bytes, workers=None):
+    import fitz  # PyMuPDF
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_document:
+        page_count = pdf_document.page_count
+        workers = min(workers or os.cpu_count() or 1, page_count)
+        if workers <= 1 or page_count < PARALLEL_EXTRACTION_MIN_PAGES:
+            return [page.get_text() for page in pdf_document]
+    try:
+        return extract_pages_in_parallel(pdf_bytes, page_count, workers)
+    except Exception:
+        # Process pools are unavailable on some hosts; fall back to a single core
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_document:
+            return [page.get_text() for page in pdf_document]
+
+# Extracted text is cached per PDF digest with pages separated by form feeds
+PAGE_SEPARATOR = "\f"
+
+# Function to identify an uploaded PDF by the SHA-256 of its bytes
+def pdf_digest(pdf_bytes):
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+# Function to locate the cached text for a PDF digest
+def text_cache_path(digest):
+    return os.path.join(TEXT_CACHE_DIR, digest + ".txt")
+
+# Function to read cached page texts through a memory map, decoding one page at a time
+def iter_cached_pages(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            start = 0
+            while True:
+                end = mapped.find(b"\f", start)
+                if end == -1:
+                    yield mapped[start:].decode("utf-8")
+                    return
+                yield mapped[start:end].decode("utf-8")
+                start = end + 1
+
+# Function to save page texts to the shared text cache
+def store_cached_pages(path, pages):
+    try:
+        os.makedirs(TEXT_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(PAGE_SEPARATOR.join(page_text.replace(PAGE_SEPARATOR, "\n") for page_text in pages))
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+# Function to get the page texts of a PDF, skipping PyMuPDF when the same file was extracted before
+def load_document_pages(pdf_bytes, digest=None, workers=None):
+    path = text_cache_path(digest or pdf_digest(pdf_bytes))
+    if os.path.exists(path):
+        return list(iter_cached_pages(path))
+    pages = extract_pages(pdf_bytes, workers)
+    store_cached_pages(path, pages)
+    return pages
+
+# A piece of the document sent to the model in one request, with the 1-based pages it spans
+Chunk = namedtuple("Chunk", ["text", "page_start", "page_end", "tokens"])
+
+_PARAGRAPH_SPLIT = re.compile(r"\n\s*\n")
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+
+# tiktoken gives exact token counts when installed; otherwise a character-based estimate is used
+@functools.lru_cache(maxsize=None)
+def _get_encoding(model):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except (KeyError, TypeError):
+        return tiktoken.get_encoding("cl100k_base")
+
+# Function to count tokens locally, exactly with tiktoken or estimated at ~4 characters per token
+def count_tokens(text, model=None):
+    encoding = _get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+# Function to split page text into sentence units that fit the budget, flagging where paragraphs start
+def split_into_units(text, max_tokens, model=None):
+    for paragraph in _PARAGRAPH_SPLIT.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        starts_paragraph = True
+        for sentence in _SENTENCE_SPLIT.split(paragraph):
+            tokens = count_tokens(sentence, model)
+            if tokens <= max_tokens:
+                yield sentence, tokens, starts_paragraph
+                starts_paragraph = False
+                continue
+            # A single sentence over the budget is rare, so split it by an approximate word count
+            for piece, piece_tokens in split_oversized_text(sentence, tokens, max_tokens, model):
+                yield piece, piece_tokens, starts_paragraph
+                starts_paragraph = False
+
+# Function to cut text over the budget into pieces that fit: by words while it has several, then by characters,
+# which covers scripts without spaces, long URLs and encoded data
+def split_oversized_text(text, tokens, max_tokens, model=None):
+    words = text.split()
+    if len(words) > 1:
+        step = max(1, len(words) * max_tokens // tokens)
+        pieces = [" ".join(words[i:i + step]) for i in range(0, len(words), step)]
+    elif len(text) > 1:
+        step = max(1, len(text) * max_tokens // tokens)
+        pieces = [text[i:i + step] for i in range(0, len(text), step)]
+    else:
+        yield text, tokens
+        return
+    for piece in pieces:
+        piece_tokens = count_tokens(piece, model)
+        if piece_tokens <= max_tokens:
+            yield piece, piece_tokens
+        else:
+            # Words and characters vary in token count, so a piece can still be over; split it again
+            yield from split_oversized_text(piece, piece_tokens, max_tokens, model)
+
+# Function to pack a stream of page texts into token-bounded chunks, yielding each one as soon as it is full
+def iter_chunks(pages, max_tokens=DEFAULT_CHUNK_TOKENS, overlap_tokens=DEFAULT_CHUNK_OVERLAP_TOKENS, model=None):
+    units = deque()  # (text, tokens, starts paragraph, page number) for the chunk being filled
+    total = 0
+    fresh = False  # Whether the buffer holds anything beyond the overlap from the previous chunk
+
+    def make_chunk():
+        parts = []
+        for text, _, starts_paragraph, _ in units:
+            if parts:
+                parts.append("\n\n" if starts_paragraph else " ")
+            parts.append(text)
+        return Chunk("".join(parts), units[0][3], units[-1][3], total)
+
+    for page_number, page_text in enumerate(pages, start=1):
+        for text, tokens, starts_paragraph in split_into_units(page_text, max_tokens, model):
+            if fresh and total + tokens > max_tokens:
+                yield make_chunk()
+                # Carry the trailing sentences over so neighbouring chunks share context
+                kept = deque()
+                kept_tokens = 0
+                while units and kept_tokens + units[-1][1] <= overlap_tokens:
+                    unit = units.pop()
+                    kept.appendleft(unit)
+                    kept_tokens += unit[1]
+                units, total, fresh = kept, kept_tokens, False
+            while units and total + tokens > max_tokens:
+                total -= units.popleft()[1]
+            units.append((text, tokens, starts_paragraph, page_number))
+            total += tokens
+            fresh = True
+    if fresh:
+        yield make_chunk()
+
+_WORD = re.compile(r"[^\W\d_]{3,}")
+
+# Function to score how much distinct material a chunk holds, so repetitive filler weighs less than its size
+def chunk_weight(chunk):
+    return len(set(_WORD.findall(chunk.text.lower())))
+
+# Function to spread the requested question total across chunks in proportion to their weight
+def allocate_questions(chunks, total_questions, weights=None):
+    weights = list(weights) if weights is not None else [chunk_weight(chunk) for chunk in chunks]
+    weight_sum = sum(weights)
+    if not chunks or total_questions <= 0:
+        return [0] * len(chunks)
+    if weight_sum == 0:
+        weights, weight_sum = [1] * len(chunks), len(chunks)
+    # Largest remainder method: floor every quota, then hand leftovers to the biggest remainders
+    quotas = [total_questions * weight / weight_sum for weight in weights]
+    allocation = [int(quota) for quota in quotas]
+    leftover = total_questions - sum(allocation)
+    by_remainder = sorted(range(len(chunks)), key=lambda i: (quotas[i] - allocation[i], weights[i]), reverse=True)
+    for i in by_remainder[:leftover]:
+        allocation[i] += 1
+    return allocation
+
+_NON_LETTERS = re.compile(r"[\W\d_]+")
+_FUNCTION_WORDS = frozenset(
+    "a an and are as at be by can for from has have in is it its not of on or so such than that the their "
+    "them then there these they this to was were when which while will with".split()
+)
+
+# Function to score how much a chunk reads like prose: indexes, bibliographies and tables of contents
+# are mostly names, numbers and punctuation with almost no function words
+def chunk_salience(text):
+    visible = len("".join(text.split()))
+    if not visible:
+        return 0.0
+    letters = len(_NON_LETTERS.sub("", text))
+    words = text.lower().split()
+    function_share = sum(1 for word in words if word in _FUNCTION_WORDS) / len(words) if words else 0.0
+    # Running English prose has roughly a third function words
+    return (letters / visible) * min(1.0, function_share / 0.3)
+
+# Function to build L2-normalised TF-IDF rows for the chunks over their most informative shared terms
+def tfidf_matrix(texts, max_vocabulary=SALIENCE_MAX_VOCABULARY):
+    import numpy as np
+    documents = [[word for word in _WORD.findall(text.lower()) if word not in _FUNCTION_WORDS] for text in texts]
+    document_frequency = Counter(term for document in documents for term in set(document))
+    # Terms in over half the chunks cannot tell chunks apart; terms in one chunk cannot link them
+    ceiling = max(1, len(documents) // 2)
+    vocabulary = [term for term, count in document_frequency.most_common() if 2 <= count <= ceiling][:max_vocabulary]
+    if not vocabulary:
+        return np.zeros((len(documents), 1), dtype=np.float32)
+    index = {term: i for i, term in enumerate(vocabulary)}
+    matrix = np.zeros((len(documents), len(vocabulary)), dtype=np.float32)
+    for row, document in enumerate(documents):
+        columns = [index[term] for term in document if term in index]
+        if columns:
+            matrix[row] = np.bincount(columns, minlength=len(vocabulary)) / len(document)
+    frequencies = np.array([document_frequency[term] for term in vocabulary], dtype=np.float32)
+    matrix *= np.log((1 + len(documents)) / (1 + frequencies)) + 1
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+# Function to group unit-length rows into k topics with spherical k-means seeded by k-means++,
+# keeping the tightest of a few restarts
+def cluster_rows(matrix, k, iterations=20, restarts=3, seed=0):
+    import numpy as np
+    best = None
+    for restart in range(restarts):
+        rng = np.random.default_rng(seed + restart)
+        centroids = [matrix[rng.integers(len(matrix))]]
+        for _ in range(1, k):
+            distance = np.maximum(1 - np.max(matrix @ np.array(centroids).T, axis=1), 0)
+            total = distance.sum()
+            centroids.append(matrix[rng.choice(len(matrix), p=distance / total) if total > 0 else rng.integers(len(matrix))])
+        centroids = np.array(centroids)
+        labels = None
+        for _ in range(iterations):
+            similarity = matrix @ centroids.T
+            new_labels = similarity.argmax(axis=1)
+            if labels is not None and np.array_equal(labels, new_labels):
+                break
+            labels = new_labels
+            centroids = np.zeros_like(centroids)
+            np.add.at(centroids, labels, matrix)
+            # A cluster that lost all its members restarts at the row worst served by the others
+            for empty in np.flatnonzero(np.bincount(labels, minlength=k) == 0):
+                centroids[empty] = matrix[similarity.max(axis=1).argmin()]
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        cohesion = np.einsum("ij,ij->", matrix, centroids[labels])
+        if best is None or cohesion > best[0]:
+            best = (cohesion, labels, centroids)
+    return best[1], best[2]
+
+# Function to pick about one chunk per SALIENCE_QUESTIONS_PER_CHUNK questions: one per topic cluster,
+# preferring prose that sits close to its topic centre, weighted by how much of the document the topic covers
+def select_salient_chunks(chunks, num_questions, questions_per_chunk=SALIENCE_QUESTIONS_PER_CHUNK):
+    import numpy as np
+    wanted = max(1, -(-int(num_questions) // questions_per_chunk))
+    if len(chunks) <= wanted:
+        return list(range(len(chunks))), None
+    salience = np.array([chunk_salience(chunk.text) for chunk in chunks])
+    # Filler is only clustered when there is not enough prose to go round
+    candidates = np.flatnonzero(salience >= 0.5 * np.median(salience))
+    if len(candidates) <= wanted:
+        candidates = np.argsort(salience)[::-1][:wanted]
+        return sorted(candidates.tolist()), None
+    matrix = tfidf_matrix([chunks[i].text for i in candidates])
+    if not matrix.any():
+        # No terms are shared between chunks to cluster on; spread the picks evenly through the document
+        picks = candidates[np.linspace(0, len(candidates) - 1, wanted).round().astype(int)]
+        return sorted(set(picks.tolist())), None
+    labels, centroids = cluster_rows(matrix, wanted)
+    tokens = np.array([chunks[i].tokens for i in candidates], dtype=np.float64)
+    fit = salience[candidates] * np.maximum(np.einsum("ij,ij->i", matrix, centroids[labels]), 1e-3)
+    selected = {}
+    for cluster in np.unique(labels):
+        members = np.flatnonzero(labels == cluster)
+        best = members[fit[members].argmax()]
+        selected[int(candidates[best])] = float(tokens[members].sum())
+    indices = sorted(selected)
+    return indices, [selected[i] for i in indices]
+
+# Function to chunk text to avoid token limit
+def chunk_text(text, max_tokens=DEFAULT_CHUNK_TOKENS, overlap_tokens=DEFAULT_CHUNK_OVERLAP_TOKENS, model=None):
+    return [chunk.text for chunk in iter_chunks([text], max_tokens, overlap_tokens, model)]
+
+# Function to build the cache key for a chunk and its generation settings
+def response_cache_key(text, num_questions, difficulty, model, backend_name="openai", output_format="text"):
+    chunk_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    params = [PROMPT_VERSION, chunk_hash, int(num_questions), difficulty, model]
+    if backend_name != "openai":
+        # Other backends get their own namespace so offline output never masquerades as real responses
+        params.append(backend_name)
+    if output_format != "text":
+        params.append(output_format)
+    params = json.dumps(params)
+    return hashlib.sha256(params.encode("utf-8")).hexdigest()
+
+# Function to read a cached model response, refreshing its LRU position on a hit
+def load_cached_response(key):
+    path = os.path.join(RESPONSE_CACHE_DIR, key[:2], key + ".txt")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            content = f.read()
+        os.utime(path)  # The modification time doubles as the last-used time
+        return content
+    except OSError:
+        return None
+
+# Function to store a model response and evict least recently used entries over the size limit
+def store_cached_response(key, content):
+    path = os.path.join(RESPONSE_CACHE_DIR, key[:2], key + ".txt")
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            replaced_bytes = os.stat(path).st_size
+        except OSError:
+            replaced_bytes = 0
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        written_bytes = os.stat(tmp_path).st_size
+        os.replace(tmp_path, path)  # Atomic, so concurrent readers never see half a file
+        track_response_cache_size(written_bytes - replaced_bytes)
+    except OSError:
+        pass
+
+# Function to add a write to the running cache size, walking the cache only when the size is unknown or over the limit.
+# Writes from other processes are picked up at the next walk.
+def track_response_cache_size(added_bytes, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+    global _response_cache_bytes
+    with _response_cache_lock:
+        if _response_cache_bytes is not None:
+            _response_cache_bytes += added_bytes
+            if _response_cache_bytes <= max_bytes:
+                return
+        _response_cache_bytes = evict_response_cache(max_bytes)
+
+# Function to walk the response cache, evict least recently used entries over max_bytes and return the remaining size
+def evict_response_cache(max_bytes=RESPONSE_CACHE_MAX_BYTES):
+    entries = []
+    total = 0
+    for root, _, files in os.walk(RESPONSE_CACHE_DIR):
+        for name in files:
+            if not name.endswith(".txt"):
+                continue
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+            total += stat.st_size
+    if total <= max_bytes:
+        return total
+    # Trim below the limit so a full cache is not walked again on the very next write
+    target = int(max_bytes * RESPONSE_CACHE_EVICT_FRACTION)
+    for _, size, path in sorted(entries):
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        if total <= target:
+            break
+    return total
+
+# Timing, token, cost and parse-yield records for one quiz generation
+class Instrumentation:
+    def __init__(self, run_id=None):
+        self.run_id = run_id or uuid.uuid4().hex
+        self.records = []
+        self._lock = threading.Lock()
+        self._open_spans = 0
+
+    # Time a stage or chunk; attributes added to the yielded record are kept with it.
+    # While tracemalloc is tracing, outermost spans also record the peak memory they allocated;
+    # nested and pool-thread spans are counted in the stage around them.
+    @contextmanager
+    def span(self, name, **attributes):
+        record = {"span": name, **attributes}
+        with self._lock:
+            trace_memory = self._open_spans == 0 and tracemalloc.is_tracing()
+            self._open_spans += 1
+        if trace_memory:
+            tracemalloc.reset_peak()
+            traced_before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            if trace_memory:
+                record["peak_mib"] = (tracemalloc.get_traced_memory()[1] - traced_before) / (1024 * 1024)
+            with self._lock:
+                self._open_spans -= 1
+                self.records.append(record)
+
+    # Totals across all records, as shown in the sidebar panel
+    def summary(self):
+        with self._lock:
+            records = list(self.records)
+        stages = {}
+        for record in records:
+            # Chunk spans overlap in time, so only the sequential stages are totalled
+            if record["span"] != "chunk":
+                stages[record["span"]] = stages.get(record["span"], 0.0) + record["seconds"]
+        chunks = [record for record in records if record["span"] == "chunk"]
+        parsed = sum(record.get("questions_parsed", 0) for record in records)
+        skipped = sum(record.get("questions_skipped", 0) for record in records)
+        # Parse yield per output format, to compare the text parser with structured output across runs
+        by_format = {}
+        for record in records:
+            if "output_format" in record and "questions_parsed" in record:
+                kept, lost = by_format.get(record["output_format"], (0, 0))
+                by_format[record["output_format"]] = (kept + record["questions_parsed"], lost + record.get("questions_skipped", 0))
+        return {
+            "run_id": self.run_id,
+            "stages": stages,
+            "chunks": len(chunks),
+            "cached_chunks": sum(1 for record in chunks if record.get("cached")),
+            "slowest_chunk_seconds": max((record["seconds"] for record in chunks), default=0.0),
+            "prompt_tokens": sum(record.get("prompt_tokens", 0) for record in chunks),
+            "completion_tokens": sum(record.get("completion_tokens", 0) for record in chunks),
+            "cost_usd": sum(record.get("cost_usd", 0.0) for record in chunks),
+            "questions_parsed": parsed,
+            "questions_skipped": skipped,
+            "parse_yield": parsed / (parsed + skipped) if parsed + skipped else None,
+            "parse_yield_by_format": {name: kept / (kept + lost) for name, (kept, lost) in by_format.items() if kept + lost},
+        }
+
+    # Append every span and the summary to the JSON lines log for the log pipeline
+    def emit_jsonl(self, path=METRICS_LOG_PATH):
+        timestamp = time.time()
+        with self._lock:
+            lines = [json.dumps({"run_id": self.run_id, "timestamp": timestamp, **record}) for record in self.records]
+        lines.append(json.dumps({"span": "summary", "timestamp": timestamp, **self.summary()}))
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+        except OSError:
+            pass
+
+# Function to add token counts and estimated cost to a span record
+def record_usage(record, model, prompt_tokens, completion_tokens, estimated=False):
+    prompt_price, completion_price = MODEL_PRICING.get(model, (0.0, 0.0))
+    record["prompt_tokens"] = prompt_tokens
+    record["completion_tokens"] = completion_tokens
+    record["cost_usd"] = (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+    record["usage_estimated"] = estimated
+
+# Refilling budget of requests or tokens per minute
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Seconds until `amount` is available; requests larger than the bucket wait for a full bucket
+    def wait_time(self, amount):
+        self._refill()
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount):
+        self._refill()
+        self.level -= amount
+
+# Function to list the transient API failures worth retrying
+@functools.lru_cache(maxsize=None)
+def retryable_errors():
+    import openai
+    return (
+        openai.error.RateLimitError,
+        openai.error.APIError,
+        openai.error.Timeout,
+        openai.error.ServiceUnavailableError,
+        openai.error.APIConnectionError,
+    )
+
+# Raised when a request cannot be sent or retried before its caller's deadline
+class DeadlineExceeded(Exception):
+    pass
+
+# Function to get the seconds left before a perf_counter deadline, or None when there is no deadline
+def seconds_left(deadline):
+    return None if deadline is None else max(0.0, deadline - time.perf_counter())
+
+# Scheduler in front of all model calls: waits for request and token budgets, retries transient errors
+class RequestScheduler:
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE, max_retries=MAX_RETRIES, base_delay=1.0, max_delay=60.0):
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._condition = threading.Condition()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.queue_depth = 0
+        self.in_flight = 0
+        self.retries = 0
+
+    # Block until one request and `tokens` tokens fit in the per-minute budgets, or the deadline passes
+    def acquire(self, tokens, deadline=None):
+        with self._condition:
+            self.queue_depth += 1
+            try:
+                while True:
+                    wait = max(self._requests.wait_time(1), self._tokens.wait_time(tokens))
+                    if wait <= 0:
+                        self._requests.take(1)
+                        self._tokens.take(tokens)
+                        return
+                    left = seconds_left(deadline)
+                    if left is not None:
+                        if left <= 0:
+                            raise DeadlineExceeded("Rate limits held the request past its deadline")
+                        wait = min(wait, left)
+                    self._condition.wait(wait)
+            finally:
+                self.queue_depth -= 1
+
+    # Return or charge the difference once the real token usage is known
+    def settle(self, estimated_tokens, actual_tokens):
+        with self._condition:
+            self._tokens.take(actual_tokens - estimated_tokens)
+            self._condition.notify_all()
+
+    # Full-jitter exponential backoff, never shorter than the server's Retry-After hint
+    def backoff_delay(self, attempt, error=None):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        headers = getattr(error, "headers", None) or {}
+        try:
+            delay = max(delay, float(headers.get("retry-after", 0)))
+        except (TypeError, ValueError):
+            pass
+        return delay
+
+    # Run `request` once the budgets allow, retrying rate limits and transient API failures.
+    # With a deadline, no wait, backoff or retry is started that would end after it.
+    def call(self, request, estimated_tokens, deadline=None):
+        for attempt in range(self.max_retries + 1):
+            self.acquire(estimated_tokens, deadline)
+            with self._condition:
+                self.in_flight += 1
+            try:
+                return request()
+            except Exception as e:
+                # A failed attempt used none of its tokens; hand the reservation back before retrying or giving up
+                self.settle(estimated_tokens, 0)
+                if not isinstance(e, retryable_errors()) or attempt == self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt, e)
+                left = seconds_left(deadline)
+                if left is not None and delay >= left:
+                    raise DeadlineExceeded(f"No time left to retry before the deadline: {e}") from e
+                with self._condition:
+                    self.retries += 1
+                time.sleep(delay)
+            finally:
+                with self._condition:
+                    self.in_flight -= 1
+
+# Function to get the scheduler shared by every session on this server
+@st.cache_resource(show_spinner=False)
+def get_request_scheduler():
+    return RequestScheduler(REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE, MAX_RETRIES)
+
+# Function to get the max_tokens sent with a request for the given number of questions
+def completion_token_limit(num_questions):
+    return int(num_questions) * COMPLETION_TOKENS_PER_QUESTION + COMPLETION_TOKENS_MARGIN
+
+# Function to estimate the tokens a generation request will consume against the per-minute budget
+def estimate_request_tokens(messages, num_questions, model):
+    prompt_tokens = sum(count_tokens(message["content"], model) for message in messages)
+    return prompt_tokens + completion_token_limit(num_questions)
+
+# Interface every model backend implements; responses follow the OpenAI chat completion shape
+class LLMBackend(abc.ABC):
+    name = "base"
+
+    # Return a completion dict, or an iterator of delta events when stream=True.
+    # With functions, the model must answer by calling the first one. A timeout in seconds bounds the request.
+    @abc.abstractmethod
+    def create(self, model, messages, max_tokens, stream=False, functions=None, timeout=None):
+        pass
+
+    # Everything about this backend that changes what it returns; quizzes are only shared between equal settings
+    def settings(self):
+        return (self.name,)
+
+# Backend calling the OpenAI chat completion API
+class OpenAIBackend(LLMBackend):
+    name = "openai"
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+
+    def create(self, model, messages, max_tokens, stream=False, functions=None, timeout=None):
+        import openai
+        if functions:
+            extra = {"functions": functions, "function_call": {"name": functions[0]["name"]}}
+        else:
+            extra = {}
+        # Passing the key per call keeps concurrent sessions with different keys apart
+        return openai.ChatCompletion.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            stream=stream,
+            api_key=self.api_key,
+            request_timeout=timeout,
+            **extra
+        )
+
+_REQUESTED_COUNT = re.compile(r"Extract (\d+) multiple-choice")
+_TEXT_SECTION = re.compile(r"\nText:\n(.*)", re.S)
+
+# Offline stand-in that writes deterministic questions from the prompt text, for benchmarks and load tests
+class FakeBackend(LLMBackend):
+    name = "fake"
+
+    def __init__(self, latency=0.2, tokens_per_second=200.0, failure_rate=0.0, malformed_rate=0.05, seed=0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.failure_rate = failure_rate
+        self.malformed_rate = malformed_rate
+        self.seed = seed
+        # Failures are drawn per attempt from their own generator, so a retried request can succeed
+        self._failure_rng = random.Random(seed)
+        self._failure_lock = threading.Lock()
+
+    def settings(self):
+        return (self.name, self.latency, self.tokens_per_second, self.failure_rate, self.malformed_rate, self.seed)
+
+    def create(self, model, messages, max_tokens, stream=False, functions=None, timeout=None):
+        prompt = messages[-1]["content"]
+        # Seeding from the prompt makes the same request always produce the same output
+        rng = random.Random(hashlib.sha256(f"{self.seed}:{model}:{prompt}".encode("utf-8")).digest())
+        time.sleep(self.latency)
+        with self._failure_lock:
+            failed = self._failure_rng.random() < self.failure_rate
+            error = self._failure_rng.choice([retryable_errors()[0], retryable_errors()[3]])
+        if failed:
+            raise error("Injected failure from FakeBackend")
+
+        count_match = _REQUESTED_COUNT.search(prompt)
+        text_match = _TEXT_SECTION.search(prompt)
+        content = self.write_questions(
+            int(count_match.group(1)) if count_match else 5,
+            text_match.group(1) if text_match else prompt,
+            rng,
+            as_json=bool(functions)
+        )
+        prompt_tokens = sum(count_tokens(message["content"], model) for message in messages)
+        completion_tokens = count_tokens(content, model)
+        if stream:
+            return self._stream(content, rng, functions[0]["name"] if functions else None)
+        if timeout is not None and self.latency + completion_tokens / self.tokens_per_second > timeout:
+            # Behave like the API client: give up once the timeout has passed
+            time.sleep(max(0.0, timeout - self.latency))
+            raise retryable_errors()[2]("Request timed out (FakeBackend)")
+        time.sleep(completion_tokens / self.tokens_per_second)
+        if functions:
+            message = {"role": "assistant", "content": None, "function_call": {"name": functions[0]["name"], "arguments": content}}
+        else:
+            message = {"role": "assistant", "content": content}
+        return {
+            "choices": [{"message": message, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    # Yield the content a few words at a time at the configured throughput
+    def _stream(self, content, rng, function_name=None):
+        words = content.split(" ")
+        for i in range(0, len(words), 4):
+            piece = " ".join(words[i:i + 4]) + (" " if i + 4 < len(words) else "")
+            time.sleep(count_tokens(piece) / self.tokens_per_second)
+            if function_name:
+                yield {"choices": [{"delta": {"function_call": {"arguments": piece}}, "finish_reason": None}]}
+            else:
+                yield {"choices": [{"delta": {"content": piece}, "finish_reason": None}]}
+
+    # Build question text from sentences of the chunk, breaking some on purpose
+    def write_questions(self, num_questions, text, rng, as_json=False):
+        sentences = [s for s in _SENTENCE_SPLIT.split(" ".join(text.split())) if len(s.split()) >= 4] or ["The text has no complete sentences."]
+        words = text.split() or ["none"]
+        blocks = []
+        items = []
+        for i in range(num_questions):
+            sentence = rng.choice(sentences)
+            options = [" ".join(sentence.split()[:8])] + [" ".join(rng.choices(words, k=6)) for _ in range(3)]
+            rng.shuffle(options)
+            correct = "ABCD"[options.index(" ".join(sentence.split()[:8]))]
+            if as_json:
+                item = {"question": "Which of the following appears in the text?", "options": options, "correct": correct}
+                if rng.random() < self.malformed_rate:
+                    # The same mistakes in structured form: a missing option or a missing answer
+                    if rng.random() < 0.5:
+                        del item["options"][-1]
+                    else:
+                        del item["correct"]
+                items.append(item)
+                continue
+            lines = [f"{i + 1}. Which of the following appears in the text?"]
+            lines.extend(f"{letter}) {option}" for letter, option in zip("ABCD", options))
+            lines.append(f"Correct Answer: {correct}")
+            if rng.random() < self.malformed_rate:
+                # Typical model mistakes: a missing option or a missing answer line
+                del lines[rng.choice([2, -1])]
+            blocks.append("\n".join(lines))
+        if as_json:
+            return json.dumps({"questions": items})
+        return "\n\n".join(blocks)
+
+# Function to accept either a backend or an OpenAI API key string
+def resolve_backend(backend):
+    if isinstance(backend, LLMBackend):
+        return backend
+    return OpenAIBackend(backend)
+
+# Function to generate questions through the configured model backend
+def generate_questions(text, num_questions, difficulty, model, backend, use_cache=True, record=None, output_format="text", avoid=None,
+                       deadline=None):
+    backend = resolve_backend(backend)
+    record = record if record is not None else {}
+    # Requests that list questions to avoid are one-off follow-ups, so they never touch the cache
+    use_cache = use_cache and not avoid
+    cache_key = response_cache_key(text, num_questions, difficulty, model, backend.name, output_format)
+    if use_cache:
+        cached = load_cached_response(cache_key)
+        if cached is not None:
+            record["cached"] = True
+            return cached
+
+    messages = build_messages(text, num_questions, difficulty, output_format, avoid)
+    functions = [QUESTION_FUNCTION] if output_format == "json" else None
+    estimated_tokens = estimate_request_tokens(messages, num_questions, model)
+    scheduler = get_request_scheduler()
+
+    try:
+        response = scheduler.call(
+            lambda: backend.create(
+                model, messages, max_tokens=completion_token_limit(num_questions), functions=functions,
+                timeout=seconds_left(deadline)
+            ),
+            estimated_tokens,
+            deadline
+        )
+        content = message_text(response["choices"][0]["message"])
+        if "usage" in response:
+            scheduler.settle(estimated_tokens, response["usage"]["total_tokens"])
+            record_usage(record, model, response["usage"]["prompt_tokens"], response["usage"]["completion_tokens"])
+        if use_cache and content:
+            store_cached_response(cache_key, content)
+        return content
+    except DeadlineExceeded as e:
+        # Running out of time is a budget decision by the caller, not a failure worth showing
+        record["deadline_exceeded"] = str(e)
+        return ""
+    except Exception as e:
+        record["error"] = str(e)
+        notify("error", f"Error generating questions: {e}")
+        return ""
+
+# Schema for structured output: the model fills these arguments instead of writing free text
+QUESTION_FUNCTION = {
+    "name": "record_questions",
+    "description": "Record multiple-choice questions about the text.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "questions": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "question": {"type": "string"},
+                        "options": {"type": "array", "items": {"type": "string"}, "minItems": 4, "maxItems": 4},
+                        "correct": {"type": "string", "enum": ["A", "B", "C", "D"]},
+                    },
+                    "required": ["question", "options", "correct"],
+                },
+            },
+        },
+        "required": ["questions"],
+    },
+}
+
+# Function to get the text of a reply: the function call arguments in JSON mode, otherwise the content
+def message_text(message):
+    function_call = message.get("function_call")
+    if function_call:
+        return function_call.get("arguments") or ""
+    return message.get("content") or ""
+
+# Function to build the chat prompt asking for questions from a chunk
+def build_messages(text, num_questions, difficulty, output_format="text", avoid=None):
+    avoid_section = ""
+    if avoid:
+        avoid_section = "\nDo not repeat these questions, which were already asked:\n" + "\n".join(f"- {q}" for q in avoid) + "\n"
+    if output_format == "json":
+        return [
+            {"role": "system", "content": "You are a helpful assistant that creates multiple-choice questions."},
+            {"role": "user", "content": f"""
+Extract {num_questions} multiple-choice questions from the text below with {difficulty} difficulty level.
+Record them with the record_questions function. Give each question exactly four options without letter labels,
+and set correct to the letter (A, B, C or D) of the right option.
+{avoid_section}
+Text:
+{text}
+"""}
+        ]
+    return [
+        {"role": "system", "content": "You are a helpful assistant that creates multiple-choice questions."},
+        {"role": "user", "content": f"""
+Extract {num_questions} multiple-choice questions from the text below with {difficulty} difficulty level.
+Each question should follow this format:
+1. Question text
+A) Option 1
+B) Option 2
+C) Option 3
+D) Option 4
+Correct Answer: X (where X is A, B, C, or D)
+{avoid_section}
+Text:
+{text}
+"""}
+    ]
+
+# Function to generate questions for a stream of (chunk text, question count) jobs in parallel, yielding responses in document order.
+# A job may carry a third item, the questions that chunk must not repeat.
+def stream_generated_responses(jobs, difficulty, model, backend, max_workers=DEFAULT_CONCURRENCY, use_cache=True, metrics=None,
+                               output_format="text", deadline=None):
+    ctx = get_script_run_ctx(suppress_warning=True)
+    max_workers = max(1, int(max_workers))
+    metrics = metrics if metrics is not None else Instrumentation()
+
+    def worker(index, text, num_questions, avoid):
+        # Attach the Streamlit script context so notify reaches the page from pool threads
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        with metrics.span("chunk", chunk=index, questions_requested=num_questions) as record:
+            return generate_questions(
+                text, num_questions, difficulty, model, backend, use_cache, record, output_format, avoid, deadline
+            )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for index, (text, num_questions, *avoid) in enumerate(jobs):
+            pending.append(executor.submit(worker, index, text, num_questions, avoid[0] if avoid else None))
+            # Hand back finished chunks at the head of the queue without waiting on later ones
+            while pending and pending[0].done():
+                yield pending.popleft().result()
+            # Don't read further ahead of the API than the pool can keep busy
+            if len(pending) >= max_workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+# MinHash settings for near-duplicate detection: 16 bands of 4 rows catch pairs from roughly 50% similarity
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16
+DUPLICATE_THRESHOLD = 0.7
+_OPTION_LABEL = re.compile(r"^[A-D]\)\s*")
+_NON_ALNUM = re.compile(r"[\W_]+")
+
+# Function to reduce a question and its options to lowercase words for comparison
+def question_fingerprint_text(question):
+    options = " ".join(_OPTION_LABEL.sub("", option) for option in question["options"])
+    return _NON_ALNUM.sub(" ", f"{question['question']} {options}".lower()).strip()
+
+# Function to compute MinHash signatures over 4-byte shingles of every text at once
+def minhash_signatures(texts, num_perm=MINHASH_PERMUTATIONS, seed=1):
+    import numpy as np
+    # Pad to one full shingle so every text contributes at least one
+    encoded = [text.encode("utf-8").ljust(4) for text in texts]
+    lengths = np.fromiter((len(data) for data in encoded), dtype=np.int64, count=len(encoded))
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.uint64)
+    # Each shingle is the four bytes starting at a position, packed into one integer
+    shingles = data[:-3] | (data[1:-2] << 8) | (data[2:-1] << 16) | (data[3:] << 24)
+
+    # Drop the shingles that straddle two texts
+    counts = lengths - 3
+    text_starts = np.cumsum(lengths) - lengths
+    segment_starts = np.cumsum(counts) - counts
+    positions = np.repeat(text_starts - segment_starts, counts) + np.arange(counts.sum())
+    values = shingles[positions]
+
+    # Multiply-shift hashing: wrapping 64-bit arithmetic, keeping the high 32 bits
+    rng = np.random.default_rng(seed)
+    a = rng.integers(0, 1 << 63, num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 1 << 63, num_perm, dtype=np.uint64)
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint32)
+    # Hash a few permutations at a time to keep the intermediate matrix small
+    for start in range(0, num_perm, 8):
+        stop = min(start + 8, num_perm)
+        hashed = a[start:stop, None] * values[None, :]
+        hashed += b[start:stop, None]
+        hashed >>= np.uint64(32)
+        signatures[:, start:stop] = np.minimum.reduceat(hashed.astype(np.uint32), segment_starts, axis=1).T
+    return signatures
+
+# Function to drop near-duplicate questions, keeping the first occurrence in document order
+def deduplicate_questions(questions, threshold=DUPLICATE_THRESHOLD, num_perm=MINHASH_PERMUTATIONS, bands=MINHASH_BANDS):
+    import numpy as np
+    if len(questions) < 2:
+        return list(questions)
+    signatures = minhash_signatures([question_fingerprint_text(q) for q in questions], num_perm)
+    rows = num_perm // bands
+    # Collapse each band of the signature into a single bucket key
+    band_keys = [
+        signatures[:, band * rows:(band + 1) * rows].copy().view(f"V{rows * 4}").ravel().tolist()
+        for band in range(bands)
+    ]
+
+    buckets = {}
+    kept = []
+    for i in range(len(questions)):
+        candidates = set()
+        for band in range(bands):
+            candidates.update(buckets.get((band, band_keys[band][i]), ()))
+        # LSH only proposes candidates; confirm with the estimated Jaccard similarity
+        if candidates:
+            matches = np.count_nonzero(signatures[list(candidates)] == signatures[i], axis=1)
+            if matches.max() >= threshold * num_perm:
+                continue
+        kept.append(i)
+        for band in range(bands):
+            buckets.setdefault((band, band_keys[band][i]), []).append(i)
+    return [questions[i] for i in kept]
+
+_OPTION_LINE = re.compile(r"^[A-D]\)")
+_CORRECT_LINE = re.compile(r"Correct Answer:\s*([A-D])")
+_NUMBERED_LINE = re.compile(r"^(?:Q(?:uestion)?\s*)?\d+[.):]")
+
+# Incremental state-machine parser for model output: feed text as it arrives and collect finished questions
+class QuestionParser:
+    def __init__(self):
+        self.skipped = []  # Question texts that had options or an answer but were malformed
+        self._partial_line = ""
+        self._question = None
+        self._options = []
+        self._text_ended = False  # A blank line closed the question text, so the next text line starts a new question
+
+    # Accept the next piece of raw output and return the questions it completed
+    def feed(self, text):
+        lines = (self._partial_line + text).split("\n")
+        self._partial_line = lines.pop()
+        completed = []
+        for line in lines:
+            self._consume(line.strip(), completed)
+        return completed
+
+    # Flush the last line once the output has ended and return any questions it completed
+    def close(self):
+        completed = []
+        self._consume(self._partial_line.strip(), completed)
+        self._partial_line = ""
+        self._discard()
+        return completed
+
+    def _consume(self, line, completed):
+        if not line:
+            # Keeps a preamble such as "Here are the questions:" from merging into an unnumbered first question
+            self._text_ended = self._question is not None
+            return
+        # Cheap character checks first; the regexes only run on lines that can match
+        if line[1:2] == ")" and _OPTION_LINE.match(line):
+            if self._question is not None:
+                self._options.append(line)
+            return
+        correct_match = _CORRECT_LINE.search(line) if "Correct Answer" in line else None
+        if correct_match:
+            if self._question is not None:
+                letter = correct_match.group(1)
+                correct = next((opt for opt in self._options if opt.startswith(f"{letter})")), None)
+                if len(self._options) == 4 and correct:
+                    completed.append({"question": self._question, "options": self._options, "correct": correct})
+                else:
+                    self.skipped.append(self._question)
+            self._question = None
+            self._options = []
+            return
+        # Any other line starts a new question, unless it continues question text that has no options yet
+        if self._question is None or self._options or self._text_ended or _NUMBERED_LINE.match(line):
+            self._discard()
+            self._question = line
+            self._text_ended = False
+        else:
+            self._question = f"{self._question} {line}"
+
+    # Drop an unfinished question, remembering it if it already looked like one
+    def _discard(self):
+        if self._question is not None and self._options:
+            self.skipped.append(self._question)
+        self._question = None
+        self._options = []
+
+# Function to parse generated questions into a structured format
+def parse_questions(raw_questions, record=None):
+    parser = QuestionParser()
+    questions = parser.feed(raw_questions)
+    questions.extend(parser.close())
+    for q in parser.skipped:
+        notify("warning", f"Skipping invalid question: {q}")
+    if record is not None:
+        record["output_format"] = "text"
+        record["questions_parsed"] = len(questions)
+        record["questions_skipped"] = len(parser.skipped)
+    return questions
+
+# Function to pick the fastest JSON decoder available
+@functools.lru_cache(maxsize=None)
+def json_decoder():
+    try:
+        import orjson
+        return orjson.loads
+    except ImportError:
+        return json.loads
+
+# Function to turn one structured question into the quiz format, or None when it breaks the schema
+def question_from_json(item):
+    if not isinstance(item, dict):
+        return None
+    question, options, letter = item.get("question"), item.get("options"), item.get("correct")
+    if not isinstance(question, str) or not question.strip():
+        return None
+    if not isinstance(options, list) or len(options) != 4 or not all(isinstance(option, str) and option.strip() for option in options):
+        return None
+    letter = letter.strip().rstrip(")").upper() if isinstance(letter, str) else None
+    if letter not in ("A", "B", "C", "D"):
+        return None
+    # Models sometimes label the options themselves; keep a single label either way
+    options = [option.strip() for option in options]
+    options = [
+        f"{label}) {_OPTION_LABEL.sub('', option) if option[1:2] == ')' else option}" for label, option in zip("ABCD", options)
+    ]
+    return {"question": question.strip(), "options": options, "correct": options["ABCD".index(letter)]}
+
+# Function to parse function-call arguments into questions, skipping items that break the schema
+def parse_json_questions(raw_arguments, record=None):
+    questions = []
+    skipped = 0
+    try:
+        items = json_decoder()(raw_arguments).get("questions", [])
+    except (ValueError, AttributeError) as e:
+        notify("warning", f"Could not decode the structured response: {e}")
+        items = []
+    for item in items if isinstance(items, list) else []:
+        question = question_from_json(item)
+        if question is None:
+            skipped += 1
+            notify("warning", f"Skipping invalid question: {item.get('question', item) if isinstance(item, dict) else item}")
+        else:
+            questions.append(question)
+    if record is not None:
+        record["output_format"] = "json"
+        record["questions_parsed"] = len(questions)
+        record["questions_skipped"] = skipped
+    return questions
+
+# Function to parse a response written in either output format
+def parse_response(raw, output_format="text", record=None):
+    if output_format == "json":
+        return parse_json_questions(raw, record)
+    return parse_questions(raw, record)
+
+# Function to stream questions from the model, yielding each one as soon as its Correct Answer line arrives.
+# Structured responses are only valid JSON once complete, so their questions arrive together at the end.
+def stream_questions(text, num_questions, difficulty, model, backend, use_cache=True, record=None, output_format="text"):
+    backend = resolve_backend(backend)
+    record = record if record is not None else {}
+    cache_key = response_cache_key(text, num_questions, difficulty, model, backend.name, output_format)
+    if use_cache:
+        cached = load_cached_response(cache_key)
+        if cached is not None:
+            record["cached"] = True
+            yield from parse_response(cached, output_format, record)
+            return
+
+    messages = build_messages(text, num_questions, difficulty, output_format)
+    functions = [QUESTION_FUNCTION] if output_format == "json" else None
+    record["output_format"] = output_format
+    estimated_tokens = estimate_request_tokens(messages, num_questions, model)
+    scheduler = get_request_scheduler()
+    parser = QuestionParser()
+    parts = []
+    response = None
+    try:
+        # Only opening the stream is retried; a retry mid-stream would repeat questions already shown
+        response = scheduler.call(
+            lambda: backend.create(
+                model, messages, max_tokens=completion_token_limit(num_questions), stream=True, functions=functions
+            ),
+            estimated_tokens
+        )
+        for event in response:
+            delta = event["choices"][0]["delta"]
+            if functions:
+                piece = (delta.get("function_call") or {}).get("arguments", "")
+                if piece:
+                    parts.append(piece)
+                continue
+            piece = delta.get("content", "")
+            if piece:
+                parts.append(piece)
+                yield from parser.feed(piece)
+        if functions:
+            yield from parse_json_questions("".join(parts), record)
+        else:
+            yield from parser.close()
+    except Exception as e:
+        record["error"] = str(e)
+        notify("error", f"Error generating questions: {e}")
+        return
+    finally:
+        # Once the stream is open, hand back the part of the max_tokens reservation it did not use, also when it
+        # fails or its reader stops early. Streamed responses carry no usage block, so count tokens locally.
+        if response is not None:
+            prompt_tokens = sum(count_tokens(message["content"], model) for message in messages)
+            completion_tokens = count_tokens("".join(parts), model)
+            scheduler.settle(estimated_tokens, prompt_tokens + completion_tokens)
+    for q in parser.skipped:
+        notify("warning", f"Skipping invalid question: {q}")
+
+    content = "".join(parts)
+    record_usage(record, model, prompt_tokens, completion_tokens, estimated=True)
+    if not functions:
+        record["questions_skipped"] = len(parser.skipped)
+    if use_cache and content:
+        store_cached_response(cache_key, content)
+
+# Function to stream many (chunk text, question count) jobs in parallel, yielding (job index, question) as each question completes
+def stream_questions_concurrently(jobs, difficulty, model, backend, max_workers=DEFAULT_CONCURRENCY, use_cache=True, metrics=None,
+                                  output_format="text"):
+    ctx = get_script_run_ctx(suppress_warning=True)
+    results = queue.Queue()
+    finished = object()
+    metrics = metrics if metrics is not None else Instrumentation()
+
+    def worker(index, text, num_questions):
+        # Attach the Streamlit script context so notify reaches the page from pool threads
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        try:
+            with metrics.span("chunk", chunk=index, questions_requested=num_questions) as record:
+                parsed = 0
+                for question in stream_questions(text, num_questions, difficulty, model, backend, use_cache, record, output_format):
+                    parsed += 1
+                    results.put((index, question))
+                record["questions_parsed"] = parsed
+        finally:
+            results.put((index, finished))
+
+    jobs = list(jobs)
+    with ThreadPoolExecutor(max_workers=max(1, int(max_workers))) as executor:
+        for index, (text, num_questions) in enumerate(jobs):
+            executor.submit(worker, index, text, num_questions)
+        remaining = len(jobs)
+        while remaining:
+            index, item = results.get()
+            if item is finished:
+                remaining -= 1
+            else:
+                yield index, item
+
+_QUESTION_BANK_SCHEMA = """
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY,
+    doc_hash TEXT NOT NULL,
+    difficulty TEXT NOT NULL,
+    model TEXT NOT NULL,
+    backend TEXT NOT NULL,
+    chunk_index INTEGER,
+    page_start INTEGER,
+    page_end INTEGER,
+    question TEXT NOT NULL,
+    options TEXT NOT NULL,
+    correct TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    UNIQUE (doc_hash, difficulty, model, backend, question, correct)
+);
+CREATE INDEX IF NOT EXISTS idx_questions_lookup ON questions (doc_hash, difficulty, model, backend);
+CREATE INDEX IF NOT EXISTS idx_questions_pages ON questions (doc_hash, page_start, page_end);
+"""
+
+# Function to open the local question bank, creating its tables and indexes on first use
+def open_question_bank(path=QUESTION_BANK_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30)
+    try:
+        # WAL lets sessions keep reading while another session writes
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(_QUESTION_BANK_SCHEMA)
+    except sqlite3.Error:
+        connection.close()
+        raise
+    return connection
+
+# Function to save parsed questions with the document, chunk and settings they came from
+def store_bank_questions(doc_hash, difficulty, model, backend_name, questions, path=QUESTION_BANK_PATH):
+    rows = [
+        (
+            doc_hash, difficulty, model, backend_name,
+            q.get("chunk"), q.get("page_start"), q.get("page_end"),
+            q["question"], json.dumps(q["options"]), q["correct"], time.time()
+        )
+        for q in questions
+    ]
+    connection = open_question_bank(path)
+    try:
+        with connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO questions (doc_hash, difficulty, model, backend, chunk_index, page_start, page_end, "
+                "question, options, correct, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+    finally:
+        connection.close()
+
+# Function to assemble a quiz from the bank, or return None when too few matching questions are stored
+def load_bank_questions(doc_hash, difficulty, model, backend_name, num_questions, path=QUESTION_BANK_PATH):
+    connection = open_question_bank(path)
+    try:
+        key = (doc_hash, difficulty, model, backend_name)
+        where = "doc_hash = ? AND difficulty = ? AND model = ? AND backend = ?"
+        (available,) = connection.execute(f"SELECT COUNT(*) FROM questions WHERE {where}", key).fetchone()
+        if available < num_questions:
+            return None
+        rows = connection.execute(
+            f"SELECT chunk_index, page_start, page_end, question, options, correct FROM questions "
+            f"WHERE {where} ORDER BY RANDOM() LIMIT ?",
+            key + (int(num_questions),)
+        ).fetchall()
+    finally:
+        connection.close()
+    # Present the sample in document order
+    rows.sort(key=lambda row: (row[1] is None, row[1] or 0, row[0] or 0))
+    return [
+        {"question": question, "options": json.loads(options), "correct": correct, "difficulty": difficulty,
+         "chunk": chunk_index, "page_start": page_start, "page_end": page_end}
+        for chunk_index, page_start, page_end, question, options, correct in rows
+    ]
+
+# Function to plan a top-up: spread the shortfall over the chunks with the fewest questions for their weight
+def plan_top_up(chunks, pool, weights, questions, shortfall, questions_per_chunk=SALIENCE_QUESTIONS_PER_CHUNK):
+    counts = Counter(question.get("chunk") for question in questions)
+    weights = weights or [chunk_weight(chunks[i]) for i in pool]
+    by_coverage = sorted(zip(pool, weights), key=lambda item: (counts[item[0]] / max(item[1], 1), -item[1]))
+    targets = by_coverage[:max(1, -(-shortfall // questions_per_chunk))]
+    allocation = allocate_questions([chunks[i] for i, _ in targets], shortfall, [weight for _, weight in targets])
+    return [(i, count) for (i, _), count in zip(targets, allocation) if count]
+
+# Function to run the whole pipeline for one PDF, calling on_question for each question as it arrives
+def build_quiz(pdf_bytes, num_questions, difficulty, model, backend, max_workers=DEFAULT_CONCURRENCY,
+               chunk_tokens=DEFAULT_CHUNK_TOKENS, overlap_tokens=DEFAULT_CHUNK_OVERLAP_TOKENS,
+               use_cache=True, stream_responses=False, metrics=None, on_question=None, use_bank=True, select_chunks=True,
+               output_format="text", top_up=True):
+    metrics = metrics if metrics is not None else Instrumentation()
+    on_question = on_question or (lambda question: None)
+    backend = resolve_backend(backend)
+    digest = pdf_digest(pdf_bytes)
+
+    if use_bank:
+        # Enough stored questions for this document and settings means no model call at all
+        with metrics.span("question_bank") as record:
+            try:
+                questions = load_bank_questions(digest, difficulty, model, backend.name, num_questions)
+            except (sqlite3.Error, OSError) as e:
+                # Like the other caches, an unusable bank only costs the shortcut; generate instead
+                notify("warning", f"Could not read the question bank: {e}")
+                record["bank_error"] = str(e)
+                questions = None
+            record["hit"] = questions is not None
+        if questions is not None:
+            for question in questions:
+                on_question(question)
+            return questions
+
+    try:
+        # Chunking is local and cheap; the whole document is needed to split the question budget
+        with metrics.span("extract") as record:
+            pages = load_document_pages(pdf_bytes, digest, EXTRACTION_WORKERS)
+            record["pages"] = len(pages)
+        with metrics.span("chunk_text") as record:
+            chunks = list(iter_chunks(pages, chunk_tokens, overlap_tokens, model))
+            record["chunks"] = len(chunks)
+    except Exception as e:
+        notify("error", f"Error extracting text from PDF: {e}")
+        return None
+    if not chunks:
+        return None
+
+    selected, weights = list(range(len(chunks))), None
+    if select_chunks:
+        with metrics.span("select_chunks") as record:
+            selected, weights = select_salient_chunks(chunks, num_questions)
+            record["selected"] = len(selected)
+
+    with metrics.span("allocate") as record:
+        allocation = allocate_questions([chunks[i] for i in selected], num_questions, weights)
+        # Chunks allocated zero questions are never sent to the model
+        job_chunks = [i for i, count in zip(selected, allocation) if count]
+        jobs = [(chunks[i].text, count) for i, count in zip(selected, allocation) if count]
+        record["requests"] = len(jobs)
+
+    # Tag each question with where it came from, for the question bank
+    def annotate(chunk_index, question):
+        question.update(
+            chunk=chunk_index, page_start=chunks[chunk_index].page_start, page_end=chunks[chunk_index].page_end,
+            difficulty=difficulty
+        )
+        return question
+
+    questions = []
+    with metrics.span("generate"):
+        if stream_responses:
+            # Questions arrive in completion order; remember their chunk to restore document order afterwards
+            arrived = []
+            for index, question in stream_questions_concurrently(
+                jobs, difficulty, model, backend, max_workers, use_cache, metrics, output_format
+            ):
+                arrived.append((index, annotate(job_chunks[index], question)))
+                on_question(question)
+            arrived.sort(key=lambda item: item[0])
+            questions = [question for _, question in arrived]
+        else:
+            responses = stream_generated_responses(jobs, difficulty, model, backend, max_workers, use_cache, metrics, output_format)
+            for index, response in enumerate(responses):
+                with metrics.span("parse", chunk=index) as record:
+                    parsed = [annotate(job_chunks[index], question) for question in parse_response(response, output_format, record)]
+                questions.extend(parsed)
+                for question in parsed:
+                    on_question(question)
+
+    with metrics.span("dedup") as record:
+        questions = deduplicate_questions(questions)
+        record["questions"] = len(questions)
+
+    if top_up and len(questions) < num_questions:
+        with metrics.span("top_up") as record:
+            deadline = time.perf_counter() + TOP_UP_MAX_SECONDS
+            initial = len(questions)
+            requested = 0
+            spent_tokens = 0
+            rounds = 0
+            while len(questions) < num_questions and rounds < TOP_UP_MAX_ROUNDS:
+                plan = plan_top_up(chunks, selected, weights, questions, num_questions - len(questions))
+                # Each request lists what its chunk already produced, so the new questions survive dedup
+                jobs = [
+                    (chunks[i].text, count, [q["question"] for q in questions if q.get("chunk") == i])
+                    for i, count in plan
+                ]
+                estimated = sum(
+                    estimate_request_tokens(build_messages(text, count, difficulty, output_format, avoid), count, model)
+                    for text, count, avoid in jobs
+                )
+                if spent_tokens + estimated > TOP_UP_MAX_TOKENS or seconds_left(deadline) <= 0:
+                    record["stopped_by_budget"] = True
+                    break
+                rounds += 1
+                requested += sum(count for _, count in plan)
+                spent_tokens += estimated
+                added = []
+                # The deadline also bounds the round itself: rate-limit waits, retries and each request's timeout
+                responses = stream_generated_responses(
+                    jobs, difficulty, model, backend, max_workers, False, metrics, output_format, deadline
+                )
+                for (chunk_index, _), response in zip(plan, responses):
+                    with metrics.span("parse", chunk=chunk_index, top_up=True) as parse_record:
+                        added.extend(annotate(chunk_index, q) for q in parse_response(response, output_format, parse_record))
+                before = len(questions)
+                questions = deduplicate_questions(questions + added)
+                for question in questions[before:]:
+                    on_question(question)
+                if seconds_left(deadline) <= 0:
+                    record["stopped_by_budget"] = True
+                    break
+                if len(questions) == before:
+                    break
+            record.update(rounds=rounds, requested=requested, added=len(questions) - initial, estimated_tokens=spent_tokens)
+        # Keep document order after appending top-up questions
+        questions.sort(key=lambda question: question.get("chunk", 0))
+    if use_bank and questions:
+        # Every parsed question is banked, including extras beyond this quiz, so later quizzes can draw on them
+        with metrics.span("question_bank_store") as record:
+            record["questions"] = len(questions)
+            try:
+                store_bank_questions(digest, difficulty, model, backend.name, questions)
+            except (sqlite3.Error, OSError) as e:
+                notify("warning", f"Could not save questions to the question bank: {e}")
+
+    # A model that wrote extra questions would overshoot the requested count
+    return questions[:num_questions]
+
+# Function to name the topic a question belongs to, from the pages its chunk covers
+def question_topic(question):
+    page_start, page_end = question.get("page_start"), question.get("page_end")
+    if page_start is None:
+        return "Whole document"
+    return f"Page {page_start}" if page_start == page_end else f"Pages {page_start}-{page_end}"
+
+# Function to map labels to dense integer ids, returning the distinct labels in first-seen order and the ids
+def encode_labels(labels):
+    ids = {}
+    codes = [ids.setdefault(label, len(ids)) for label in labels]
+    return list(ids), codes
+
+# Class to score quiz attempts with the answer key and responses held as integer option indices
+class ScoringEngine:
+    UNANSWERED = -1
+
+    def __init__(self, questions):
+        import numpy as np
+        self.key = np.array([question["options"].index(question["correct"]) for question in questions], dtype=np.int8)
+        self.topics, topic_ids = encode_labels(question_topic(question) for question in questions)
+        self.difficulties, difficulty_ids = encode_labels(question.get("difficulty", "Unknown") for question in questions)
+        self.topic_ids = np.array(topic_ids, dtype=np.int32)
+        self.difficulty_ids = np.array(difficulty_ids, dtype=np.int32)
+
+    # Empty response row for one attempt, one option index per question
+    def blank_responses(self):
+        import numpy as np
+        return np.full(len(self.key), self.UNANSWERED, dtype=np.int8)
+
+    # Responses may be one attempt (1-D) or many attempts stacked as rows (2-D)
+    def correctness(self, responses):
+        import numpy as np
+        return np.asarray(responses, dtype=np.int8) == self.key
+
+    def scores(self, responses):
+        return self.correctness(responses).sum(axis=-1)
+
+    # Correct answers per group, summed over every attempt in the (attempts x questions) matrix
+    def _group_rates(self, correct, group_ids, labels):
+        import numpy as np
+        sizes = np.bincount(group_ids, minlength=len(labels))
+        hits = np.bincount(group_ids, weights=correct.sum(axis=0), minlength=len(labels))
+        rates = hits / np.maximum(sizes * correct.shape[0], 1)
+        return [
+            {"group": label, "questions": int(size), "correct": int(hit), "rate": float(rate)}
+            for label, size, hit, rate in zip(labels, sizes, hits, rates)
+        ]
+
+    def report(self, responses, bins=10):
+        import numpy as np
+        responses = np.atleast_2d(np.asarray(responses, dtype=np.int8))
+        correct = self.correctness(responses)
+        scores = correct.sum(axis=1)
+        percentages = scores * 100.0 / max(len(self.key), 1)
+        distribution, edges = np.histogram(percentages, bins=bins, range=(0, 100))
+        return {
+            "attempts": correct.shape[0],
+            "questions": len(self.key),
+            "correct": int(scores.sum()),
+            # UNANSWERED never matches the key, so these are already counted wrong
+            "unanswered": int((responses == self.UNANSWERED).sum()),
+            "mean_percentage": float(percentages.mean()) if len(percentages) else 0.0,
+            "question_rates": correct.mean(axis=0),
+            "by_topic": self._group_rates(correct, self.topic_ids, self.topics),
+            "by_difficulty": self._group_rates(correct, self.difficulty_ids, self.difficulties),
+            "distribution": list(zip(edges[:-1].tolist(), distribution.tolist())),
+        }
+
+# Class to record when each question was first shown, answered and how long it stayed on screen.
+# Times are float32 offsets from the quiz start, 12 bytes per question per session.
+class QuestionTimer:
+    def __init__(self, num_questions, start_time=None):
+        import numpy as np
+        self.start_time = start_time if start_time is not None else time.time()
+        self.first_view = np.full(num_questions, np.nan, dtype=np.float32)
+        self.answered = np.full(num_questions, np.nan, dtype=np.float32)
+        self.dwell = np.zeros(num_questions, dtype=np.float32)
+        self._page = None
+        self._shown_at = 0.0
+        # Pages of several questions are timed as a whole, so times are only per question while every page holds one
+        self.per_question = True
+
+    def _now(self):
+        return time.time() - self.start_time
+
+    # Reruns of the page already on screen keep its original display time
+    def page_shown(self, start, stop):
+        import numpy as np
+        if self._page == (start, stop):
+            return
+        now = self._now()
+        if self._page is not None:
+            self.page_left([])
+        self._page = (start, stop)
+        self._shown_at = now
+        self.per_question = self.per_question and stop - start <= 1
+        np.fmin(self.first_view[start:stop], now, out=self.first_view[start:stop])
+
+    # Every question on the page was visible for the whole visit; changed answers are stamped now
+    def page_left(self, changed):
+        if self._page is None:
+            return
+        now = self._now()
+        start, stop = self._page
+        self.dwell[start:stop] += now - self._shown_at
+        if changed:
+            self.answered[list(changed)] = now
+        self._page = None
+
+    # Percentiles of time on screen and of first view to final answer, plus the slowest questions.
+    # With several questions per page these are page visit times shared by every question on the page.
+    def report(self, percentiles=(50, 90, 99), slowest=3):
+        import numpy as np
+        latency = self.answered - self.first_view
+        answered = latency[~np.isnan(latency)]
+        return {
+            "dwell": dict(zip(percentiles, np.percentile(self.dwell, percentiles).tolist())) if len(self.dwell) else {},
+            "latency": dict(zip(percentiles, np.percentile(answered, percentiles).tolist())) if len(answered) else {},
+            "slowest": [(int(i), float(self.dwell[i])) for i in np.argsort(self.dwell)[::-1][:slowest]],
+            "per_question": self.per_question,
+        }
+
+# Lock file in each history partition: compaction holds it exclusively, readers share it. The leading dot keeps
+# it out of dataset discovery.
+ATTEMPT_PARTITION_LOCK = ".compact.lock"
+
+# Function to describe the columns stored for every submitted attempt
+@functools.lru_cache(maxsize=None)
+def attempt_history_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ("attempt_id", pa.string()),
+        ("submitted_at", pa.timestamp("s", tz="UTC")),
+        ("doc_hash", pa.string()),
+        ("difficulty", pa.string()),
+        ("model", pa.string()),
+        ("questions", pa.int32()),
+        ("correct", pa.int32()),
+        ("percentage", pa.float32()),
+        ("total_seconds", pa.float32()),
+        ("dwell_p50", pa.float32()),
+        ("dwell_p90", pa.float32()),
+    ])
+
+# Function to write a table under a hidden name and rename it, so readers never see a partial file
+def write_attempt_file(table, partition):
+    import pyarrow.parquet as pq
+    name = f"part-{uuid.uuid4().hex}.parquet"
+    # Dataset discovery skips names starting with a dot
+    pq.write_table(table, os.path.join(partition, "." + name))
+    os.replace(os.path.join(partition, "." + name), os.path.join(partition, name))
+
+# Function to list the finished attempt files of a partition
+def list_attempt_files(partition):
+    return [name for name in os.listdir(partition) if name.endswith(".parquet") and not name.startswith(".")]
+
+# Function to hold a partition's lock file, shared or exclusive, across threads and processes.
+# Yields whether the lock was taken; without `wait` it yields False at once when the lock is held elsewhere.
+@contextmanager
+def attempt_partition_lock(partition, exclusive=False, wait=True):
+    import fcntl
+    fd = os.open(os.path.join(partition, ATTEMPT_PARTITION_LOCK), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | (0 if wait else fcntl.LOCK_NB))
+            locked = True
+        except BlockingIOError:
+            locked = False
+        yield locked
+    finally:
+        # Closing the descriptor releases the lock
+        os.close(fd)
+
+# Function to append one submitted attempt to the history, merging the day's files once there are many
+def record_attempt(row, path=ATTEMPT_HISTORY_DIR, submitted_at=None):
+    import pyarrow as pa
+    submitted_at = submitted_at or datetime.now(timezone.utc)
+    partition = os.path.join(path, f"date={submitted_at:%Y-%m-%d}")
+    os.makedirs(partition, exist_ok=True)
+    table = pa.Table.from_pylist([{**row, "submitted_at": submitted_at}], schema=attempt_history_schema())
+    write_attempt_file(table, partition)
+    if len(list_attempt_files(partition)) >= ATTEMPT_HISTORY_COMPACT_FILES:
+        try:
+            compact_attempt_partition(partition)
+        except OSError as e:
+            # The attempt is already saved; the next submission merges the partition again
+            logger.warning(f"Could not compact the attempt history in {partition}: {e}")
+
+# Function to merge a day's attempt files into one, so a dashboard scan opens one file per day.
+# Returns False without merging when another compaction or a reader holds the partition.
+def compact_attempt_partition(partition):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    with attempt_partition_lock(partition, exclusive=True, wait=False) as locked:
+        if not locked:
+            return False
+        tables = []
+        paths = []
+        for name in list_attempt_files(partition):
+            file_path = os.path.join(partition, name)
+            try:
+                tables.append(pq.read_table(file_path, schema=attempt_history_schema()))
+            except FileNotFoundError:
+                # Removed since the listing by something that does not take the lock
+                continue
+            paths.append(file_path)
+        if len(paths) < 2:
+            return False
+        write_attempt_file(pa.concat_tables(tables), partition)
+        # Readers hold the shared lock while they list and read, so none sees the merged file next to its sources
+        for file_path in paths:
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+    return True
+
+# Function to load chosen columns of the attempt history, skipping partitions and row groups outside the filters
+def load_attempt_history(columns, since=None, difficulty=None, doc_hash=None, path=ATTEMPT_HISTORY_DIR):
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    if not os.path.isdir(path):
+        return None
+    partitioning = ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive")
+    conditions = []
+    if since is not None:
+        conditions.append(ds.field("date") >= f"{since:%Y-%m-%d}")
+    if difficulty is not None:
+        conditions.append(ds.field("difficulty") == difficulty)
+    if doc_hash is not None:
+        conditions.append(ds.field("doc_hash") == doc_hash)
+    condition = functools.reduce(lambda a, b: a & b, conditions) if conditions else None
+    with ExitStack() as locks:
+        # Compaction cannot swap a partition's files while it is being listed and read
+        for name in sorted(os.listdir(path)):
+            partition = os.path.join(path, name)
+            if name.startswith("date=") and os.path.isdir(partition) and (since is None or name >= f"date={since:%Y-%m-%d}"):
+                locks.enter_context(attempt_partition_lock(partition))
+        dataset = ds.dataset(path, format="parquet", partitioning=partitioning, schema=attempt_history_schema().append(pa.field("date", pa.string())))
+        return dataset.to_table(columns=columns, filter=condition)
+
+# Function to aggregate attempts into daily and per-difficulty trends
+def attempt_history_trends(table):
+    daily = table.group_by("date").aggregate([("percentage", "mean"), ("percentage", "count"), ("total_seconds", "mean")])
+    by_difficulty = table.group_by("difficulty").aggregate([("percentage", "mean"), ("percentage", "count")])
+    return daily.sort_by("date"), by_difficulty.sort_by("difficulty")
+
+# Function to build the key identifying one quiz: the document plus every setting that changes its questions
+def shared_quiz_key(digest, num_questions, difficulty, model, backend, chunk_tokens, overlap_tokens, select_chunks, output_format,
+                    top_up, use_bank):
+    return (
+        digest, int(num_questions), difficulty, model, resolve_backend(backend).settings(), int(chunk_tokens),
+        int(overlap_tokens), bool(select_chunks), output_format, bool(top_up), bool(use_bank)
+    )
+
+# Function to tell whether a built quiz is worth sharing: every chunk request succeeded and nothing is missing
+def quiz_build_complete(questions, num_questions, metrics):
+    return bool(questions) and len(questions) >= num_questions and not any("error" in record for record in metrics.records)
+
+# Raised to sessions waiting on a shared quiz whose building session was interrupted
+class QuizBuildInterrupted(Exception):
+    pass
+
+# Class to share generated quizzes across sessions, building each key once while other requesters wait
+class SharedQuizStore:
+    def __init__(self, max_entries=SHARED_QUIZ_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.builds = 0
+        self.hits = 0
+        self.waits = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Returns the questions and whether this call built them. Builds that `keep` rejects are handed to the
+    # sessions already waiting on them but not kept for later requesters.
+    def get_or_build(self, key, build, keep=bool):
+        with self._lock:
+            future = self._entries.get(key)
+            if future is None:
+                future = self._entries[key] = Future()
+                owner = True
+                self.builds += 1
+                self._evict()
+            else:
+                self._entries.move_to_end(key)
+                if future.done():
+                    self.hits += 1
+                else:
+                    self.waits += 1
+                owner = False
+        if not owner:
+            # Another session is generating this quiz; block on its result instead of generating again
+            try:
+                return future.result(), False
+            except QuizBuildInterrupted:
+                # The building session was stopped or rerun, so build it here (or wait on whoever got there first)
+                return self.get_or_build(key, build, keep)
+        try:
+            questions = build()
+        except Exception as e:
+            self._forget(key, future)
+            future.set_exception(e)
+            raise
+        except BaseException:
+            # Streamlit reruns and stops are control flow for the building session only; waiters must not receive them
+            self._forget(key, future)
+            future.set_exception(QuizBuildInterrupted("The session building this quiz stopped before it finished"))
+            raise
+        if not keep(questions):
+            self._forget(key, future)
+        future.set_result(questions)
+        return questions, True
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._entries.get(key) is future:
+                del self._entries[key]
+
+    # Drop the least recently used finished quizzes; in-flight builds are never evicted
+    def _evict(self):
+        excess = len(self._entries) - self.max_entries
+        for key in [key for key, future in self._entries.items() if future.done()][:max(excess, 0)]:
+            del self._entries[key]
+
+# Function to get the quiz store shared by every session on this server
+@st.cache_resource(show_spinner=False)
+def get_shared_quiz_store():
+    return SharedQuizStore(SHARED_QUIZ_MAX_ENTRIES)
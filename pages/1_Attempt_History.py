@@ -0,0 +1,69 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import streamlit as st
+
+from examtool_pipeline import attempt_history_trends, load_attempt_history
+
+# Only these columns are read from the Parquet files
+DASHBOARD_COLUMNS = ["date", "difficulty", "percentage", "total_seconds"]
+
+
+# Function to load and aggregate the attempts in the selected window, refreshed at most every 30 seconds
+@st.cache_data(ttl=30, show_spinner=False)
+def load_trends(days, difficulty):
+    start = time.perf_counter()
+    since = datetime.now(timezone.utc) - timedelta(days=days - 1)
+    table = load_attempt_history(DASHBOARD_COLUMNS, since=since, difficulty=difficulty)
+    if table is None or table.num_rows == 0:
+        return None
+    daily, by_difficulty = attempt_history_trends(table)
+    percentages = table.column("percentage").to_numpy()
+    counts, edges = np.histogram(percentages, bins=10, range=(0, 100))
+    summary = {
+        "attempts": table.num_rows,
+        "mean_percentage": float(percentages.mean()),
+        "median_seconds": float(np.median(table.column("total_seconds").to_numpy())),
+        "load_seconds": time.perf_counter() - start,
+    }
+    distribution = {"score": [f"{edge:.0f}-{edge + 10:.0f}%" for edge in edges[:-1]], "attempts": counts}
+    return summary, daily.to_pandas(), by_difficulty.to_pandas(), distribution
+
+
+def main():
+    st.title("Attempt History")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        days = st.selectbox("Period", [7, 30, 90, 365], index=1, format_func=lambda d: f"Last {d} days")
+    with col2:
+        difficulty = st.selectbox("Difficulty", ["All", "Easy", "Medium", "Hard"])
+
+    trends = load_trends(days, None if difficulty == "All" else difficulty)
+    if trends is None:
+        st.info("No attempts recorded in this period yet. Submit a quiz to start the history.")
+        return
+    summary, daily, by_difficulty, distribution = trends
+
+    metrics_col1, metrics_col2, metrics_col3 = st.columns(3)
+    metrics_col1.metric("Attempts", f"{summary['attempts']:,}")
+    metrics_col2.metric("Average score", f"{summary['mean_percentage']:.1f}%")
+    metrics_col3.metric("Median time", f"{summary['median_seconds']:.0f} s")
+
+    st.subheader("Average score per day")
+    st.line_chart(daily, x="date", y="percentage_mean")
+    st.subheader("Attempts per day")
+    st.bar_chart(daily, x="date", y="percentage_count")
+
+    st.subheader("By difficulty")
+    st.table(by_difficulty.rename(columns={
+        "difficulty": "Difficulty", "percentage_mean": "Average score", "percentage_count": "Attempts"
+    }))
+
+    st.subheader("Score distribution")
+    st.bar_chart(distribution, x="score", y="attempts")
+    st.caption(f"Loaded {summary['attempts']:,} attempts in {summary['load_seconds']:.3f} s")
+
+
+main()
@@ -0,0 +1,66 @@
+import os
+import threading
+
+import pytest
+
+import examtool_pipeline
+from examtool_pipeline import attempt_partition_lock, compact_attempt_partition, load_attempt_history, record_attempt
+
+pytest.importorskip("pyarrow")
+
+ROW = {"doc_hash": "doc", "difficulty": "Medium", "model": "gpt-3.5-turbo", "questions": 5, "correct": 3, "percentage": 60.0,
+       "total_seconds": 30.0}
+
+
+# Function to record `count` attempts into the history at `path`, returning the partition they landed in
+def record_attempts(path, count):
+    for i in range(count):
+        record_attempt({**ROW, "attempt_id": str(i)}, path=str(path))
+    return os.path.join(str(path), os.listdir(str(path))[0])
+
+
+def test_concurrent_submissions_keep_every_attempt(monkeypatch, tmp_path):
+    monkeypatch.setattr(examtool_pipeline, "ATTEMPT_HISTORY_COMPACT_FILES", 4)
+    errors = []
+
+    def submit(worker):
+        try:
+            for i in range(25):
+                record_attempt({**ROW, "attempt_id": f"{worker}-{i}"}, path=str(tmp_path))
+        except Exception as e:
+            errors.append(e)
+
+    def read():
+        # A compaction seen half-done would show the merged attempts twice
+        while any(thread.is_alive() for thread in threads):
+            ids = load_attempt_history(["attempt_id"], path=str(tmp_path)).column("attempt_id").to_pylist()
+            if len(ids) != len(set(ids)):
+                errors.append(f"{len(ids) - len(set(ids))} attempts read twice")
+
+    threads = [threading.Thread(target=submit, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    reader = threading.Thread(target=read)
+    reader.start()
+    for thread in threads + [reader]:
+        thread.join()
+    assert errors == []
+    assert load_attempt_history(["attempt_id"], path=str(tmp_path)).num_rows == 100
+
+
+def test_compaction_waits_for_readers(tmp_path):
+    partition = record_attempts(tmp_path, 3)
+    with attempt_partition_lock(partition):
+        assert not compact_attempt_partition(partition)
+    assert compact_attempt_partition(partition)
+    assert len(examtool_pipeline.list_attempt_files(partition)) == 1
+    assert load_attempt_history(["attempt_id"], path=str(tmp_path)).num_rows == 3
+
+
+def test_compaction_skips_files_that_disappeared(monkeypatch, tmp_path):
+    partition = record_attempts(tmp_path, 3)
+    listed = examtool_pipeline.list_attempt_files(partition) + ["part-gone.parquet"]
+    monkeypatch.setattr(examtool_pipeline, "list_attempt_files", lambda partition: listed)
+    assert compact_attempt_partition(partition)
+    monkeypatch.undo()
+    assert load_attempt_history(["attempt_id"], path=str(tmp_path)).num_rows == 3
@@ -0,0 +1,20 @@
+import pytest
+
+from examtool_pipeline import iter_chunks
+
+
+@pytest.mark.parametrize("text", [
+    "Hello world. " + "x" * 20000,
+    "漢字のテキストには空白がありません。" * 1000,
+    "See https://example.com/" + "a/b" * 5000 + " for details.",
+    "Short words " * 3000,
+])
+def test_every_chunk_fits_the_budget(text):
+    chunks = list(iter_chunks([text], 2000))
+    assert chunks
+    assert max(chunk.tokens for chunk in chunks) <= 2000
+
+
+def test_text_without_whitespace_is_kept_whole():
+    text = "y" * 20000
+    assert "".join(chunk.text for chunk in iter_chunks([text], 500)) == text
@@ -0,0 +1,105 @@
+import pytest
+
+from bench_parser import legacy_parse_questions, make_raw_output
+from examtool_pipeline import QuestionParser, parse_questions
+
+QUESTION = """1. What is the powerhouse of the cell?
+A) Nucleus
+B) Mitochondria
+C) Ribosome
+D) Golgi apparatus
+Correct Answer: B"""
+
+
+# Function to parse output fed in pieces of the given size, as a stream would deliver it
+def parse_in_pieces(raw, size):
+    parser = QuestionParser()
+    questions = []
+    for start in range(0, len(raw), size):
+        questions.extend(parser.feed(raw[start:start + size]))
+    questions.extend(parser.close())
+    return questions, parser.skipped
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_legacy_parser_on_blank_separated_output(seed):
+    raw = make_raw_output(200, malformed_rate=0.1, missing_blank_rate=0, seed=seed)
+    assert parse_questions(raw) == legacy_parse_questions(raw)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_keeps_every_legacy_question_when_blank_lines_are_missing(seed):
+    raw = make_raw_output(200, malformed_rate=0.1, missing_blank_rate=0.3, seed=seed)
+    questions = parse_questions(raw)
+    assert all(question in questions for question in legacy_parse_questions(raw))
+    assert len(questions) > len(legacy_parse_questions(raw))
+
+
+@pytest.mark.parametrize("size", [1, 7, 64])
+def test_streamed_pieces_parse_like_whole_output(size):
+    raw = make_raw_output(50, malformed_rate=0.1, missing_blank_rate=0.2, seed=3)
+    questions, _ = parse_in_pieces(raw, size)
+    assert questions == parse_questions(raw)
+
+
+def test_parses_a_single_question():
+    assert parse_questions(QUESTION) == [{
+        "question": "1. What is the powerhouse of the cell?",
+        "options": ["A) Nucleus", "B) Mitochondria", "C) Ribosome", "D) Golgi apparatus"],
+        "correct": "B) Mitochondria",
+    }]
+
+
+def test_preamble_does_not_merge_into_unnumbered_question():
+    raw = "Here are the questions:\n\nWhat is X?\nA) One\nB) Two\nC) Three\nD) Four\nCorrect Answer: A"
+    questions = parse_questions(raw)
+    assert [q["question"] for q in questions] == ["What is X?"]
+
+
+def test_preamble_without_blank_line_is_replaced_by_numbered_question():
+    questions = parse_questions("Here are the questions:\n" + QUESTION)
+    assert [q["question"] for q in questions] == ["1. What is the powerhouse of the cell?"]
+
+
+def test_wrapped_question_text_is_joined():
+    raw = QUESTION.replace("of the cell?", "of\nthe cell?")
+    assert parse_questions(raw)[0]["question"] == "1. What is the powerhouse of the cell?"
+
+
+def test_blank_line_between_question_and_options_keeps_question():
+    raw = QUESTION.replace("cell?\n", "cell?\n\n")
+    assert parse_questions(raw)[0]["question"] == "1. What is the powerhouse of the cell?"
+
+
+def test_consecutive_questions_without_blank_lines():
+    raw = QUESTION + "\n" + QUESTION.replace("1. What", "2. What")
+    assert [q["question"][:2] for q in parse_questions(raw)] == ["1.", "2."]
+
+
+def test_windows_line_endings():
+    assert parse_questions(QUESTION.replace("\n", "\r\n")) == parse_questions(QUESTION)
+
+
+def test_question_with_three_options_is_skipped():
+    raw = QUESTION.replace("D) Golgi apparatus\n", "")
+    parser = QuestionParser()
+    assert parser.feed(raw) + parser.close() == []
+    assert parser.skipped == ["1. What is the powerhouse of the cell?"]
+
+
+def test_answer_letter_without_matching_option_is_skipped():
+    raw = QUESTION.replace("Correct Answer: B", "Correct Answer: D").replace("D) Golgi apparatus", "E) Golgi apparatus")
+    assert parse_questions(raw) == []
+
+
+def test_truncated_output_drops_the_unfinished_question():
+    raw = QUESTION + "\n\n2. Which organelle makes proteins?\nA) Ribosome\nB) Lysosome"
+    questions, skipped = parse_in_pieces(raw, 16)
+    assert len(questions) == 1
+    assert skipped == ["2. Which organelle makes proteins?"]
+
+
+def test_records_parse_yield():
+    record = {}
+    parse_questions(QUESTION + "\n\n" + QUESTION.replace("D) Golgi apparatus\n", ""), record)
+    assert record == {"output_format": "text", "questions_parsed": 1, "questions_skipped": 1}
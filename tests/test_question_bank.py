@@ -0,0 +1,52 @@
+import sqlite3
+
+import pytest
+
+import examtool_pipeline
+from examtool_pipeline import FakeBackend, build_quiz, load_bank_questions, store_bank_questions
+
+TEXT = " ".join(
+    f"Section {i} explains how the enzyme binds its substrate and lowers the activation energy of the reaction."
+    for i in range(40)
+)
+
+
+# Function to build a one-page PDF holding the test text
+def make_pdf():
+    fitz = pytest.importorskip("fitz")
+    document = fitz.open()
+    document.new_page().insert_textbox(fitz.Rect(50, 50, 550, 800), TEXT, fontsize=9)
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+@pytest.mark.parametrize("error", [sqlite3.DatabaseError("file is not a database"), NotADirectoryError("Not a directory")])
+def test_unusable_bank_falls_back_to_generation(monkeypatch, tmp_path, error):
+    def broken_bank(path=None):
+        raise error
+
+    monkeypatch.setattr(examtool_pipeline, "TEXT_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(examtool_pipeline, "open_question_bank", broken_bank)
+    backend = FakeBackend(latency=0, tokens_per_second=1e9, malformed_rate=0)
+    questions = build_quiz(make_pdf(), 3, "Medium", "gpt-3.5-turbo", backend, 1, 2000, 0, False, False, None, None)
+    assert len(questions) == 3
+
+
+def test_corrupt_bank_file_raises_database_error(tmp_path):
+    path = tmp_path / "bank.sqlite3"
+    path.write_text("garbage")
+    with pytest.raises(sqlite3.DatabaseError):
+        load_bank_questions("doc", "Medium", "model", "fake", 1, path=str(path))
+
+
+def test_stored_questions_are_served_back(tmp_path):
+    path = str(tmp_path / "bank.sqlite3")
+    questions = [
+        {"question": f"Q{i}?", "options": ["A) a", "B) b", "C) c", "D) d"], "correct": "A) a", "chunk": 0,
+         "page_start": 1, "page_end": 1}
+        for i in range(4)
+    ]
+    store_bank_questions("doc", "Medium", "model", "fake", questions, path=path)
+    assert load_bank_questions("doc", "Medium", "model", "fake", 5, path=path) is None
+    assert len(load_bank_questions("doc", "Medium", "model", "fake", 4, path=path)) == 4
@@ -0,0 +1,45 @@
+import openai
+import pytest
+
+import examtool_pipeline
+from examtool_pipeline import FakeBackend, RequestScheduler, stream_questions
+
+
+# Function to get a scheduler whose token budget refills too slowly to hide a leaked reservation
+def make_scheduler(max_retries=2):
+    return RequestScheduler(requests_per_minute=1000, tokens_per_minute=100000, max_retries=max_retries, base_delay=0)
+
+
+def test_failed_attempts_return_their_reservations():
+    scheduler = make_scheduler()
+
+    def request():
+        raise openai.error.RateLimitError("slow down")
+
+    with pytest.raises(openai.error.RateLimitError):
+        scheduler.call(request, 5000)
+    assert scheduler._tokens.level == pytest.approx(scheduler._tokens.capacity, abs=100)
+    assert scheduler.retries == 2
+
+
+def test_non_retryable_failure_returns_its_reservation():
+    scheduler = make_scheduler()
+
+    def request():
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        scheduler.call(request, 5000)
+    assert scheduler._tokens.level == pytest.approx(scheduler._tokens.capacity, abs=100)
+    assert scheduler.retries == 0
+
+
+def test_abandoned_stream_settles_its_reservation(monkeypatch):
+    scheduler = make_scheduler()
+    monkeypatch.setattr(examtool_pipeline, "get_request_scheduler", lambda: scheduler)
+    backend = FakeBackend(latency=0, tokens_per_second=1e9, malformed_rate=0)
+    stream = stream_questions("Enzymes lower activation energy.", 10, "Medium", "gpt-3.5-turbo", backend, use_cache=False)
+    next(stream)
+    stream.close()
+    used = scheduler._tokens.capacity - scheduler._tokens.level
+    assert 0 < used < examtool_pipeline.completion_token_limit(10)
@@ -0,0 +1,28 @@
+from examtool_pipeline import FakeBackend, Instrumentation, SharedQuizStore, quiz_build_complete, shared_quiz_key
+
+
+# Function to get the shared key of a default quiz generated by the given backend
+def key_for(backend):
+    return shared_quiz_key("doc", 5, "Medium", "gpt-3.5-turbo", backend, 2000, 0, True, "text", True, True)
+
+
+def test_fake_backend_settings_are_part_of_the_key():
+    assert key_for(FakeBackend()) == key_for(FakeBackend())
+    assert key_for(FakeBackend()) != key_for(FakeBackend(failure_rate=0.5))
+    assert key_for(FakeBackend()) != key_for(FakeBackend(malformed_rate=0.5))
+    assert key_for(FakeBackend()) != key_for(FakeBackend(latency=0))
+
+
+def test_incomplete_builds_are_not_kept():
+    store = SharedQuizStore()
+    metrics = Instrumentation()
+    with metrics.span("chunk") as record:
+        record["error"] = "Injected failure from FakeBackend"
+    keep = lambda questions: quiz_build_complete(questions, 3, metrics)
+    assert store.get_or_build("key", lambda: ["q1", "q2", "q3"], keep) == (["q1", "q2", "q3"], True)
+    assert store.get_or_build("key", lambda: ["q1", "q2", "q3"], keep)[1]
+
+    metrics = Instrumentation()
+    assert store.get_or_build("key", lambda: ["q1", "q2"], keep)[1]
+    assert store.get_or_build("key", lambda: ["q1", "q2", "q3"], keep)[1]
+    assert not store.get_or_build("key", lambda: ["q4"], keep)[1]